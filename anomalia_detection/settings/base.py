@@ -244,6 +244,9 @@ CAPTURE_SETTINGS = {
     'DURATION': config('CAPTURE_DURATION', default=300, cast=int),
     'INTERVAL': config('CAPTURE_INTERVAL', default=20, cast=int),
     'AUTO_START': config('AUTO_START_CAPTURE', default=True, cast=bool),
+    # Segundos que la captura automática espera al primer acceso web; también es
+    # la vigencia de la marca en cache (requiere una cache compartida, p. ej. Redis)
+    'START_DELAY': config('CAPTURE_START_DELAY', default=20, cast=int),
     'CAPTURE_DIR': MEDIA_ROOT / 'captures',
     'CSV_DIR': MEDIA_ROOT / 'csv_files',
 }
@@ -39,7 +39,9 @@ class SystemConfigurationAdmin(admin.ModelAdmin):
     
     fieldsets = (
         ('Configuración de Captura', {
-            'fields': ('capture_interval', 'capture_duration', 'auto_start_capture', 'network_interface')
+            'fields': ('capture_interval', 'capture_duration', 'auto_start_capture', 'network_interface',
+                       'capture_buffer_size', 'capture_ring_filesize', 'capture_ring_files',
+                       'capture_cpu')
         }),
         ('Configuración de Procesamiento', {
             'fields': ('batch_size', 'auto_process_csv', 'auto_predict')
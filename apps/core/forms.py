@@ -69,6 +69,7 @@ class SystemConfigurationForm(forms.ModelForm):
         model = SystemConfiguration
         fields = [
             'capture_interval', 'capture_duration', 'auto_start_capture', 'network_interface',
+            'capture_buffer_size', 'capture_ring_filesize', 'capture_ring_files', 'capture_cpu',
             'batch_size', 'auto_process_csv', 'auto_predict',
             'ml_contamination', 'retrain_interval',
             'alert_threshold', 'email_alerts',
@@ -79,6 +80,10 @@ class SystemConfigurationForm(forms.ModelForm):
             'capture_duration': forms.NumberInput(attrs={'class': 'form-control', 'min': '10', 'max': '7200'}),
             'auto_start_capture': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
             'network_interface': forms.TextInput(attrs={'class': 'form-control'}),
+            'capture_buffer_size': forms.NumberInput(attrs={'class': 'form-control', 'min': '2', 'max': '1024'}),
+            'capture_ring_filesize': forms.NumberInput(attrs={'class': 'form-control', 'min': '1024', 'max': '4194304'}),
+            'capture_ring_files': forms.NumberInput(attrs={'class': 'form-control', 'min': '2', 'max': '100'}),
+            'capture_cpu': forms.NumberInput(attrs={'class': 'form-control', 'min': '0'}),
             'batch_size': forms.NumberInput(attrs={'class': 'form-control', 'min': '10', 'max': '10000'}),
             'auto_process_csv': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
             'auto_predict': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
@@ -95,7 +100,8 @@ class SystemConfigurationForm(forms.ModelForm):
         # Organizar campos en secciones
         self.field_sections = {
             'Configuración de Captura': [
-                'capture_interval', 'capture_duration', 'auto_start_capture', 'network_interface'
+                'capture_interval', 'capture_duration', 'auto_start_capture', 'network_interface',
+                'capture_buffer_size', 'capture_ring_filesize', 'capture_ring_files', 'capture_cpu'
             ],
             'Configuración de Procesamiento': [
                 'batch_size', 'auto_process_csv', 'auto_predict'
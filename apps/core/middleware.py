@@ -2,12 +2,14 @@
 Middleware personalizado para el sistema.
 """
 
+from django.core.cache import cache
 from django.utils import timezone
 from django.contrib.auth import logout
 from django.shortcuts import redirect
 from django.conf import settings
 from django.http import HttpResponseForbidden
 import logging
+import time
 
 from .models import AuditLog
 from .utils import get_client_ip, log_user_action
@@ -18,6 +20,9 @@ logger = logging.getLogger(__name__)
 class SecurityMiddleware:
     """Middleware de seguridad personalizado"""
     
+    # Instante (monotónico) hasta el que la marca de acceso sigue vigente en este proceso
+    first_access_expires = 0.0
+    
     def __init__(self, get_response):
         self.get_response = get_response
     
@@ -40,6 +45,15 @@ class SecurityMiddleware:
             request.user.update_last_activity()
             request.user.is_active_session = True
             request.user.save(update_fields=['last_activity', 'is_active_session'])
+            
+            # Marca de acceso inicial que espera la captura automática. Caduca con
+            # el delay de inicio, de modo que solo adelanta capturas cercanas a un
+            # acceso. Solo llega al script de captura con una cache compartida
+            # (Redis); con LocMemCache queda en la memoria de este proceso
+            if time.monotonic() >= SecurityMiddleware.first_access_expires:
+                ttl = settings.CAPTURE_SETTINGS['START_DELAY']
+                cache.add('first_access_ts', time.time(), ttl)
+                SecurityMiddleware.first_access_expires = time.monotonic() + ttl
         
         # Log de acceso para URLs importantes
         if self.should_log_access(request):
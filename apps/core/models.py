@@ -107,6 +107,31 @@ class SystemConfiguration(models.Model):
         verbose_name='Interfaz de Red',
         help_text='Interfaz de red para captura de tráfico'
     )
+    capture_buffer_size = models.IntegerField(
+        default=64,
+        validators=[MinValueValidator(2), MaxValueValidator(1024)],
+        verbose_name='Buffer de Captura (MB)',
+        help_text='Tamaño del buffer de captura del kernel (opción -B de dumpcap)'
+    )
+    capture_ring_filesize = models.IntegerField(
+        default=262144,
+        validators=[MinValueValidator(1024), MaxValueValidator(4194304)],
+        verbose_name='Tamaño de Archivo Rotativo (KB)',
+        help_text='Tamaño máximo de cada archivo PCAP antes de rotar'
+    )
+    capture_ring_files = models.IntegerField(
+        default=8,
+        validators=[MinValueValidator(2), MaxValueValidator(100)],
+        verbose_name='Archivos Rotativos',
+        help_text='Número máximo de archivos PCAP que se conservan por sesión en el pipeline streaming'
+    )
+    capture_cpu = models.IntegerField(
+        null=True,
+        blank=True,
+        validators=[MinValueValidator(0)],
+        verbose_name='CPU de Captura',
+        help_text='Núcleo al que se fija dumpcap (vacío: último núcleo disponible)'
+    )
     
     # Configuración de procesamiento
     batch_size = models.IntegerField(
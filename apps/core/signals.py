@@ -5,10 +5,11 @@ Señales de Django para el sistema.
 from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.core.cache import cache
 from django.utils import timezone
 import logging
 
-from .models import CustomUser, AuditLog, SystemAlert
+from .models import CustomUser, AuditLog, SystemAlert, SystemConfiguration
 from .utils import log_user_action, create_system_alert
 
 logger = logging.getLogger(__name__)
@@ -121,6 +122,12 @@ def handle_new_alert(sender, instance, created, **kwargs):
             logger.error(f"Error handling new alert: {e}")
 
 
+@receiver(post_save, sender=SystemConfiguration)
+def invalidate_config_cache(sender, instance, **kwargs):
+    """Invalida la configuración cacheada por los scripts de captura"""
+    cache.delete('system_config')
+
+
 @receiver(post_delete, sender=AuditLog)
 def log_audit_deletion(sender, instance, **kwargs):
     """Registra eliminación de logs de auditoría"""
@@ -85,6 +85,9 @@ class SystemConfigurationTest(TestCase):
         self.assertEqual(config.capture_duration, 300)
         self.assertTrue(config.auto_start_capture)
         self.assertEqual(config.network_interface, 'eth0')
+        self.assertEqual(config.capture_buffer_size, 64)
+        self.assertEqual(config.capture_ring_filesize, 262144)
+        self.assertEqual(config.capture_ring_files, 8)
 
 
 class AuditLogTest(TestCase):
@@ -134,13 +134,13 @@ def api_traffic_stats(request):
     
     recent_traffic = TraficoRed.objects.filter(fecha_captura__gte=thirty_min_ago)
     
-    stats = {
-        'total_recent': recent_traffic.count(),
-        'anomalies_recent': recent_traffic.filter(label='ANOMALO').count(),
-        'normal_recent': recent_traffic.filter(label='NORMAL').count(),
-        'unprocessed_recent': recent_traffic.filter(procesado=False).count(),
-        'timestamp': timezone.now().isoformat()
-    }
+    stats = recent_traffic.aggregate(
+        total_recent=Count('id'),
+        anomalies_recent=Count('id', filter=Q(label='ANOMALO')),
+        normal_recent=Count('id', filter=Q(label='NORMAL')),
+        unprocessed_recent=Count('id', filter=Q(procesado=False)),
+    )
+    stats['timestamp'] = timezone.now().isoformat()
     
     return JsonResponse(stats)
 
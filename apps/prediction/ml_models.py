@@ -14,6 +14,9 @@ import joblib
 import logging
 from django.conf import settings
 
+# Etiqueta por índice: 0 normal, 1 anomalía (-1 en IsolationForest)
+ETIQUETAS = np.array(['NORMAL', 'ANOMALO'], dtype=object)
+
 
 class PredictorAnomalias:
     """Predictor de anomalías usando Isolation Forest"""
@@ -29,13 +32,20 @@ class PredictorAnomalias:
     
     def cargar_modelo(self):
         """Carga modelo pre-entrenado o crea uno nuevo"""
+        bundle_path = os.path.join(settings.MEDIA_ROOT, 'models', 'anomaly_model.joblib')
         model_path = os.path.join(settings.MEDIA_ROOT, 'models', 'anomaly_model.pkl')
         scaler_path = os.path.join(settings.MEDIA_ROOT, 'models', 'scaler.pkl')
         
         try:
-            if os.path.exists(model_path) and os.path.exists(scaler_path):
-                self.modelo = joblib.load(model_path)
-                self.scaler = joblib.load(scaler_path)
+            if os.path.exists(bundle_path):
+                estado = joblib.load(bundle_path, mmap_mode='r')
+                self.modelo = estado['model']
+                self.scaler = estado['scaler']
+                logging.info("Modelo cargado exitosamente")
+            elif os.path.exists(model_path) and os.path.exists(scaler_path):
+                # Formato anterior: modelo y scaler en archivos separados
+                self.modelo = joblib.load(model_path, mmap_mode='r')
+                self.scaler = joblib.load(scaler_path, mmap_mode='r')
                 logging.info("Modelo cargado exitosamente")
             else:
                 self.entrenar_modelo_inicial()
@@ -55,9 +65,15 @@ class PredictorAnomalias:
                 # Crear modelo con datos sintéticos
                 datos_sinteticos = self.generar_datos_sinteticos()
                 self.scaler = StandardScaler()
-                X_scaled = self.scaler.fit_transform(datos_sinteticos)
+                X_scaled = self.scaler.fit_transform(datos_sinteticos.to_numpy(dtype=np.float32))
                 
-                self.modelo = IsolationForest(contamination=0.1, random_state=42)
+                self.modelo = IsolationForest(
+                    contamination=0.1,
+                    random_state=42,
+                    n_estimators=50,
+                    max_samples=256,
+                    n_jobs=-1
+                )
                 self.modelo.fit(X_scaled)
             else:
                 # Entrenar con datos reales
@@ -69,22 +85,22 @@ class PredictorAnomalias:
             
         except Exception as e:
             logging.error(f"Error entrenando modelo inicial: {e}")
-            # Modelo básico como fallback
-            self.modelo = IsolationForest(contamination=0.1, random_state=42)
-            self.scaler = StandardScaler()
+            # Sin modelo: un scaler sin ajustar fallaría en cada predicción
+            self.modelo = None
+            self.scaler = None
     
     def generar_datos_sinteticos(self):
         """Genera datos sintéticos para inicialización"""
-        np.random.seed(42)
+        rng = np.random.default_rng(42)
         n_samples = 1000
         
         data = {
-            'src_port': np.random.randint(1024, 65535, n_samples),
-            'dst_port': np.random.randint(1, 65535, n_samples),
-            'packet_size': np.random.exponential(1000, n_samples),
-            'duration': np.random.exponential(1.0, n_samples),
-            'flow_bytes_per_sec': np.random.exponential(10000, n_samples),
-            'flow_packets_per_sec': np.random.exponential(100, n_samples)
+            'src_port': rng.integers(1024, 65535, n_samples),
+            'dst_port': rng.integers(1, 65535, n_samples),
+            'packet_size': rng.exponential(1000, n_samples),
+            'duration': rng.exponential(1.0, n_samples),
+            'flow_bytes_per_sec': rng.exponential(10000, n_samples),
+            'flow_packets_per_sec': rng.exponential(100, n_samples)
         }
         
         return pd.DataFrame(data)
@@ -107,7 +123,7 @@ class PredictorAnomalias:
     
     def entrenar_modelo(self, df):
         """Entrena el modelo de detección de anomalías"""
-        X = df[self.features]
+        X = df[self.features].to_numpy(dtype=np.float32)
         
         # Preprocesamiento
         self.scaler = StandardScaler()
@@ -117,7 +133,9 @@ class PredictorAnomalias:
         self.modelo = IsolationForest(
             contamination=0.1,  # 10% de anomalías esperadas
             random_state=42,
-            n_estimators=100
+            n_estimators=50,
+            max_samples=256,
+            n_jobs=-1
         )
         self.modelo.fit(X_scaled)
         
@@ -125,6 +143,10 @@ class PredictorAnomalias:
     
     def predecir_anomalias(self, registros_ids=None):
         """Predice anomalías en registros no procesados"""
+        if self.modelo is None or self.scaler is None:
+            logging.error("Modelo no disponible")
+            return 0
+        
         try:
             from apps.traffic.models import TraficoRed
             from .models import ModeloPrediccion
@@ -141,23 +163,22 @@ class PredictorAnomalias:
                 return 0
             
             df = self.convertir_a_dataframe(registros)
-            X = df[self.features]
+            X = df[self.features].to_numpy(dtype=np.float32)
             
             # Preprocesar datos
             X_scaled = self.scaler.transform(X)
             
-            # Realizar predicciones
-            predicciones = self.modelo.predict(X_scaled)
+            # Realizar predicciones: un solo recorrido de los árboles,
+            # predict() equivale a decision_function() < 0
             scores = self.modelo.decision_function(X_scaled)
+            predicciones = np.where(scores < 0, -1, 1).astype(np.int8)
+            etiquetas = ETIQUETAS[(predicciones == -1).view(np.int8)]
+            confidencias = np.abs(scores).tolist()
             
             # Actualizar registros en base de datos
             registros_actualizados = 0
             for i, registro in enumerate(registros):
-                # -1 es anomalía, 1 es normal en IsolationForest
-                es_anomalia = predicciones[i] == -1
-                score = scores[i]
-                
-                registro.label = 'ANOMALO' if es_anomalia else 'NORMAL'
+                registro.label = etiquetas[i]
                 registro.procesado = True
                 registro.save()
                 
@@ -165,7 +186,7 @@ class PredictorAnomalias:
                 ModeloPrediccion.objects.create(
                     trafico=registro,
                     prediccion=registro.label,
-                    confidence_score=abs(score),
+                    confidence_score=confidencias[i],
                     modelo_version='isolation_forest_v1'
                 )
                 
@@ -184,8 +205,12 @@ class PredictorAnomalias:
             models_dir = os.path.join(settings.MEDIA_ROOT, 'models')
             os.makedirs(models_dir, exist_ok=True)
             
-            joblib.dump(self.modelo, os.path.join(models_dir, 'anomaly_model.pkl'))
-            joblib.dump(self.scaler, os.path.join(models_dir, 'scaler.pkl'))
+            # Temporal + rename: el archivo puede estar mapeado (mmap) por
+            # otros procesos y no debe truncarse
+            bundle_path = os.path.join(models_dir, 'anomaly_model.joblib')
+            tmp_path = f"{bundle_path}.tmp"
+            joblib.dump({'model': self.modelo, 'scaler': self.scaler}, tmp_path)
+            os.replace(tmp_path, bundle_path)
             
             logging.info("Modelo guardado exitosamente")
         except Exception as e:
@@ -194,11 +219,18 @@ class PredictorAnomalias:
     def estadisticas_prediccion(self):
         """Genera estadísticas de predicciones"""
         try:
+            from django.db.models import Count, Q
             from apps.traffic.models import TraficoRed
             
-            total = TraficoRed.objects.filter(procesado=True).count()
-            anomalos = TraficoRed.objects.filter(label='ANOMALO').count()
-            normales = TraficoRed.objects.filter(label='NORMAL').count()
+            # Los tres conteos en una sola consulta
+            conteos = TraficoRed.objects.aggregate(
+                total=Count('id', filter=Q(procesado=True)),
+                anomalos=Count('id', filter=Q(label='ANOMALO')),
+                normales=Count('id', filter=Q(label='NORMAL')),
+            )
+            total = conteos['total']
+            anomalos = conteos['anomalos']
+            normales = conteos['normales']
             
             return {
                 'total_procesados': total,
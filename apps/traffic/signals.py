@@ -186,13 +186,22 @@ def handle_capture_session_deletion(sender, instance, **kwargs):
         
         # Limpiar archivos asociados si existen
         import os
+        import glob
         
-        if instance.pcap_file_path and os.path.exists(instance.pcap_file_path):
-            try:
-                os.remove(instance.pcap_file_path)
-                logger.info(f"Archivo PCAP eliminado: {instance.pcap_file_path}")
-            except Exception as e:
-                logger.error(f"Error eliminando archivo PCAP: {e}")
+        if instance.pcap_file_path:
+            # Con ring buffer pcap_file_path es el prefijo: dumpcap añade
+            # _NNNNN_<timestamp> a cada archivo rotado (.pcap o .pcap.zst)
+            base, ext = os.path.splitext(instance.pcap_file_path)
+            pcap_files = glob.glob(f"{glob.escape(base)}_*{ext}*")
+            if os.path.exists(instance.pcap_file_path):
+                pcap_files.append(instance.pcap_file_path)
+            
+            for pcap_file in pcap_files:
+                try:
+                    os.remove(pcap_file)
+                    logger.info(f"Archivo PCAP eliminado: {pcap_file}")
+                except Exception as e:
+                    logger.error(f"Error eliminando archivo PCAP: {e}")
         
         if instance.csv_file_path and os.path.exists(instance.csv_file_path):
             try:
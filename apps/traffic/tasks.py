@@ -3,9 +3,12 @@ Tareas asíncronas para la gestión de tráfico.
 """
 
 import os
+import re
 import subprocess
 import logging
 from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
 from celery import shared_task
 from django.conf import settings
 from django.utils import timezone
@@ -13,10 +16,44 @@ from django.core.mail import send_mail
 
 from .models import TraficoRed, CaptureSession, TrafficStatistics
 from apps.core.models import SystemConfiguration, SystemAlert
-from apps.core.utils import create_system_alert, log_user_action
+from apps.core.utils import create_system_alert, log_user_action, validate_ip_address
 
 logger = logging.getLogger(__name__)
 
+# Filas por bloque al leer CSV de captura
+FILAS_POR_BLOQUE_CSV = 50000
+
+# Mapeo de columnas (ajustar según formato de flowmeter)
+COLUMNAS_CSV = {
+    'src_ip': 'src_ip',
+    'dst_ip': 'dst_ip',
+    'src_port': 'src_port',
+    'dst_port': 'dst_port',
+    'protocol': 'protocol',
+    'total_length': 'packet_size',
+    'duration': 'duration',
+    'flow_bytes_s': 'flow_bytes_per_sec',
+    'flow_packets_s': 'flow_packets_per_sec',
+    'total_fwd_packets': 'total_fwd_packets',
+    'total_backward_packets': 'total_backward_packets',
+}
+
+# Columnas a leer del CSV: nombres de Flowmeter o ya estándar
+COLUMNAS_USADAS_CSV = frozenset(COLUMNAS_CSV) | frozenset(COLUMNAS_CSV.values())
+
+# Columnas numéricas que se validan al limpiar
+COLUMNAS_NUMERICAS_CSV = [
+    'src_port', 'dst_port', 'packet_size', 'duration',
+    'flow_bytes_per_sec', 'flow_packets_per_sec'
+]
+
+# Protocolo normalizado por valor del CSV (nombre o número IANA); el resto es OTHER
+PROTOCOLOS_CSV = {codigo: codigo for codigo, _ in TraficoRed.PROTOCOL_CHOICES}
+PROTOCOLOS_CSV.update({'6': 'TCP', '17': 'UDP', '1': 'ICMP'})
+
+# IPv4 en forma de cuatro octetos 0-255
+IPV4_RE = re.compile(r'(?:(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)\.){3}(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)')
+
 
 @shared_task(bind=True)
 def iniciar_captura_trafico(self, session_id):
@@ -189,73 +226,43 @@ def procesar_archivo_csv(self, csv_filepath):
     Tarea para procesar archivo CSV y cargar datos en la base de datos
     """
     try:
-        import pandas as pd
-        
         # Verificar que el archivo existe
         if not os.path.exists(csv_filepath):
             raise Exception(f"Archivo CSV no encontrado: {csv_filepath}")
         
         logger.info(f"Procesando archivo CSV: {csv_filepath}")
         
-        # Leer CSV
-        df = pd.read_csv(csv_filepath)
-        
-        if df.empty:
-            logger.warning(f"Archivo CSV vacío: {csv_filepath}")
-            return
+        # Leer solo las columnas que se usan (originales o ya con nombre estándar)
+        # y las de texto sin inferencia de tipos, por bloques para acotar la memoria
+        lector = pd.read_csv(
+            csv_filepath,
+            usecols=lambda col: col in COLUMNAS_USADAS_CSV,
+            dtype={'src_ip': str, 'dst_ip': str, 'protocol': str},
+            chunksize=FILAS_POR_BLOQUE_CSV
+        )
         
-        # Mapeo de columnas (ajustar según formato de flowmeter)
-        column_mapping = {
-            'src_ip': 'src_ip',
-            'dst_ip': 'dst_ip',
-            'src_port': 'src_port',
-            'dst_port': 'dst_port',
-            'protocol': 'protocol',
-            'total_length': 'packet_size',
-            'duration': 'duration',
-            'flow_bytes_s': 'flow_bytes_per_sec',
-            'flow_packets_s': 'flow_packets_per_sec',
-            'total_fwd_packets': 'total_fwd_packets',
-            'total_backward_packets': 'total_backward_packets',
-        }
-        
-        # Renombrar columnas
-        available_columns = {k: v for k, v in column_mapping.items() if k in df.columns}
-        df_renamed = df.rename(columns=available_columns)
-        
-        # Limpiar y validar datos
-        df_clean = limpiar_datos_csv(df_renamed)
-        
-        # Cargar datos en la base de datos
         registros_creados = 0
+        filas_leidas = 0
         archivo_origen = os.path.basename(csv_filepath)
         
-        for _, row in df_clean.iterrows():
-            try:
-                # Preparar datos para crear registro
-                record_data = {
-                    'src_ip': row.get('src_ip', '0.0.0.0'),
-                    'dst_ip': row.get('dst_ip', '0.0.0.0'),
-                    'src_port': int(row.get('src_port', 0)),
-                    'dst_port': int(row.get('dst_port', 0)),
-                    'protocol': str(row.get('protocol', 'TCP'))[:10],
-                    'packet_size': int(row.get('packet_size', 0)),
-                    'duration': float(row.get('duration', 0.0)),
-                    'flow_bytes_per_sec': float(row.get('flow_bytes_per_sec', 0.0)),
-                    'flow_packets_per_sec': float(row.get('flow_packets_per_sec', 0.0)),
-                    'total_fwd_packets': int(row.get('total_fwd_packets', 0)),
-                    'total_backward_packets': int(row.get('total_backward_packets', 0)),
-                    'archivo_origen': archivo_origen,
-                    'procesado': False
-                }
+        with lector:
+            for bloque in lector:
+                filas_leidas += len(bloque)
                 
-                # Crear registro
-                TraficoRed.objects.create(**record_data)
-                registros_creados += 1
+                # Renombrar columnas
+                available_columns = {k: v for k, v in COLUMNAS_CSV.items() if k in bloque.columns}
+                df_renamed = bloque.rename(columns=available_columns)
                 
-            except Exception as e:
-                logger.warning(f"Error procesando fila: {e}")
-                continue
+                # Limpiar y validar datos
+                df_clean = limpiar_datos_csv(df_renamed)
+                
+                # Cargar datos en la base de datos
+                registros_creados += guardar_registros_csv(df_clean, archivo_origen)
+        
+        if filas_leidas == 0:
+            logger.warning(f"Archivo CSV vacío: {csv_filepath}")
+            marcar_csv_como_error(csv_filepath, "Archivo CSV vacío")
+            return
         
         logger.info(f"Procesamiento completado. {registros_creados} registros creados desde {csv_filepath}")
         
@@ -271,6 +278,11 @@ def procesar_archivo_csv(self, csv_filepath):
         error_msg = f"Error procesando CSV {csv_filepath}: {str(e)}"
         logger.error(error_msg)
         
+        # Fuera de en_proceso/ o de pendientes: no se reintenta un archivo
+        # que puede haber quedado cargado a medias
+        if os.path.exists(csv_filepath):
+            marcar_csv_como_error(csv_filepath, error_msg)
+        
         create_system_alert(
             title='Error procesando archivo CSV',
             description=error_msg,
@@ -280,31 +292,93 @@ def procesar_archivo_csv(self, csv_filepath):
         )
 
 
+def guardar_registros_csv(df_clean, archivo_origen):
+    """Crea los registros de TraficoRed de un bloque limpio del CSV"""
+    registros_creados = 0
+    
+    for _, row in df_clean.iterrows():
+        try:
+            # Preparar datos para crear registro
+            record_data = {
+                'src_ip': row.get('src_ip', '0.0.0.0'),
+                'dst_ip': row.get('dst_ip', '0.0.0.0'),
+                'src_port': int(row.get('src_port', 0)),
+                'dst_port': int(row.get('dst_port', 0)),
+                'protocol': str(row.get('protocol', 'TCP'))[:10],
+                'packet_size': int(row.get('packet_size', 0)),
+                'duration': float(row.get('duration', 0.0)),
+                'flow_bytes_per_sec': float(row.get('flow_bytes_per_sec', 0.0)),
+                'flow_packets_per_sec': float(row.get('flow_packets_per_sec', 0.0)),
+                'total_fwd_packets': int(row.get('total_fwd_packets', 0)),
+                'total_backward_packets': int(row.get('total_backward_packets', 0)),
+                'archivo_origen': archivo_origen,
+                'procesado': False
+            }
+            
+            # Crear registro
+            TraficoRed.objects.create(**record_data)
+            registros_creados += 1
+            
+        except Exception as e:
+            logger.warning(f"Error procesando fila: {e}")
+            continue
+    
+    return registros_creados
+
+
+def ips_validas(serie):
+    """Máscara de IPs válidas de una columna, sin llamadas por fila"""
+    s = serie.astype('string')
+    
+    # IPv4: una sola regex vectorizada sobre toda la columna
+    validas = s.str.fullmatch(IPV4_RE).fillna(False).to_numpy(dtype=bool)
+    
+    # Resto (IPv6 u otros formatos): validar solo los valores únicos
+    otros = ~validas & s.notna().to_numpy()
+    if otros.any():
+        resultado = {v: validate_ip_address(v) for v in s[otros].unique()}
+        validas[otros] = s[otros].map(resultado).to_numpy(dtype=bool)
+    
+    return validas
+
+
 def limpiar_datos_csv(df):
     """Limpia y valida datos del DataFrame"""
-    # Eliminar filas con IPs nulas
-    df = df.dropna(subset=['src_ip', 'dst_ip'])
+    # Eliminar filas con IPs nulas o inválidas
+    src_ip = df['src_ip'].astype('string').str.strip()
+    dst_ip = df['dst_ip'].astype('string').str.strip()
+    validas = ips_validas(src_ip) & ips_validas(dst_ip)
+    limpias = {'src_ip': src_ip.astype(object), 'dst_ip': dst_ip.astype(object)}
     
-    # Validar tipos de datos
-    numeric_columns = ['src_port', 'dst_port', 'packet_size', 'duration', 
-                      'flow_bytes_per_sec', 'flow_packets_per_sec']
+    # Validar tipos de datos: todas las columnas numéricas en un solo bloque
+    numeric_columns = [col for col in COLUMNAS_NUMERICAS_CSV if col in df.columns]
+    numericas = df[numeric_columns].apply(pd.to_numeric, errors='coerce').fillna(0)
     
-    for col in numeric_columns:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    # Todas las validaciones se acumulan en una única máscara, aplicada una sola vez
     
-    # Validar rangos de puertos
-    if 'src_port' in df.columns:
-        df = df[(df['src_port'] >= 0) & (df['src_port'] <= 65535)]
-    if 'dst_port' in df.columns:
-        df = df[(df['dst_port'] >= 0) & (df['dst_port'] <= 65535)]
+    # Validar rangos de puertos y guardarlos como uint16 en vez de float64
+    # (las filas fuera de rango se descartan, el recorte solo evita desbordar el cast)
+    for col in ['src_port', 'dst_port']:
+        if col in numeric_columns:
+            valores = numericas[col].to_numpy()
+            validas &= (valores >= 0) & (valores <= 65535)
+            numericas[col] = np.clip(valores, 0, 65535).astype(np.uint16)
     
     # Validar valores no negativos
     for col in ['packet_size', 'duration', 'flow_bytes_per_sec', 'flow_packets_per_sec']:
-        if col in df.columns:
-            df = df[df[col] >= 0]
+        if col in numeric_columns:
+            validas &= numericas[col].to_numpy() >= 0
     
-    return df
+    # Normalizar protocolo con un solo map a categórica (pocos valores distintos)
+    if 'protocol' in df.columns:
+        protocolo = df['protocol'].astype('string').str.strip().str.upper().map(PROTOCOLOS_CSV)
+        limpias['protocol'] = pd.Categorical(
+            protocolo.fillna('OTHER'),
+            categories=[codigo for codigo, _ in TraficoRed.PROTOCOL_CHOICES]
+        )
+    
+    df = df.assign(**limpias, **numericas)
+    return df[validas]
 
 
 def marcar_csv_como_procesado(csv_filepath):
@@ -327,6 +401,26 @@ def marcar_csv_como_procesado(csv_filepath):
         logger.error(f"Error moviendo archivo CSV: {e}")
 
 
+def marcar_csv_como_error(csv_filepath, error_msg):
+    """Mueve archivo CSV a directorio de errores"""
+    try:
+        error_dir = os.path.join(
+            settings.CAPTURE_SETTINGS['CSV_DIR'], 
+            'errors'
+        )
+        os.makedirs(error_dir, exist_ok=True)
+        
+        filename = os.path.basename(csv_filepath)
+        new_path = os.path.join(error_dir, filename)
+        
+        # Mover archivo
+        os.rename(csv_filepath, new_path)
+        logger.warning(f"Archivo CSV movido a errores: {new_path} - {error_msg}")
+        
+    except Exception as e:
+        logger.error(f"Error moviendo archivo CSV a errores: {e}")
+
+
 @shared_task
 def procesar_csv_pendientes():
     """
@@ -340,8 +434,9 @@ def procesar_csv_pendientes():
             return
         
         # Buscar archivos CSV pendientes
-        csv_files = [f for f in os.listdir(csv_dir) 
-                    if f.endswith('.csv') and os.path.isfile(os.path.join(csv_dir, f))]
+        # scandir trae el tipo de archivo con la entrada, sin un stat por archivo
+        with os.scandir(csv_dir) as entradas:
+            csv_files = [e.name for e in entradas if e.name.endswith('.csv') and e.is_file()]
         
         if not csv_files:
             logger.info("No hay archivos CSV pendientes")
@@ -349,17 +444,36 @@ def procesar_csv_pendientes():
         
         logger.info(f"Procesando {len(csv_files)} archivos CSV pendientes")
         
-        total_procesados = 0
+        # Cada archivo es independiente: se encola como tarea propia para que los
+        # workers de Celery los procesen en paralelo. Antes de encolarlo se mueve a
+        # en_proceso/ para que la siguiente ejecución periódica no lo vuelva a tomar
+        en_proceso_dir = os.path.join(csv_dir, 'en_proceso')
+        os.makedirs(en_proceso_dir, exist_ok=True)
+        
+        encolados = 0
         for csv_file in csv_files:
-            csv_path = os.path.join(csv_dir, csv_file)
+            pendiente_path = os.path.join(csv_dir, csv_file)
+            csv_path = os.path.join(en_proceso_dir, csv_file)
+            try:
+                os.rename(pendiente_path, csv_path)
+            except OSError as e:
+                logger.error(f"Error moviendo {csv_file} a en_proceso: {e}")
+                continue
+            
             try:
-                registros = procesar_archivo_csv(csv_path)
-                total_procesados += registros
+                procesar_archivo_csv.delay(csv_path)
+                encolados += 1
             except Exception as e:
-                logger.error(f"Error procesando {csv_file}: {e}")
-        
-        logger.info(f"Procesamiento completado: {total_procesados} registros totales")
-        return total_procesados
+                # Sin tarea encolada: devolver el archivo a pendientes para la
+                # siguiente ejecución periódica
+                logger.error(f"Error encolando {csv_file}: {e}")
+                try:
+                    os.rename(csv_path, pendiente_path)
+                except OSError as error:
+                    logger.error(f"Error devolviendo {csv_file} a pendientes: {error}")
+        
+        logger.info(f"{encolados} archivos CSV encolados para procesamiento")
+        return encolados
         
     except Exception as e:
         logger.error(f"Error en procesamiento de CSVs pendientes: {e}")
@@ -72,12 +72,12 @@ def calcular_estadisticas_trafico(queryset=None, periodo_horas=24):
         )
     
     stats = {
-        'resumen': {
-            'total_registros': queryset.count(),
-            'anomalias': queryset.filter(label='ANOMALO').count(),
-            'normales': queryset.filter(label='NORMAL').count(),
-            'sin_procesar': queryset.filter(procesado=False).count(),
-        },
+        'resumen': queryset.aggregate(
+            total_registros=Count('id'),
+            anomalias=Count('id', filter=Q(label='ANOMALO')),
+            normales=Count('id', filter=Q(label='NORMAL')),
+            sin_procesar=Count('id', filter=Q(procesado=False)),
+        ),
         'protocolos': list(
             queryset.values('protocol').annotate(
                 count=Count('id'),
@@ -43,13 +43,14 @@ class TrafficListView(LoginRequiredMixin, ListView):
         context['filter'] = TrafficFilter(self.request.GET, queryset=self.get_queryset())
         
         # Estadísticas rápidas
+        # (una sola consulta con conteos condicionales)
         queryset = self.get_queryset()
-        context['stats'] = {
-            'total': queryset.count(),
-            'anomalous': queryset.filter(label='ANOMALO').count(),
-            'normal': queryset.filter(label='NORMAL').count(),
-            'unprocessed': queryset.filter(procesado=False).count(),
-        }
+        context['stats'] = queryset.aggregate(
+            total=Count('id'),
+            anomalous=Count('id', filter=Q(label='ANOMALO')),
+            normal=Count('id', filter=Q(label='NORMAL')),
+            unprocessed=Count('id', filter=Q(procesado=False)),
+        )
         
         return context
 
@@ -356,12 +357,12 @@ def traffic_statistics_api(request):
                 'end_date': end_date.isoformat(),
                 'days': days
             },
-            'totals': {
-                'total_records': total_traffic.count(),
-                'anomalous_records': total_traffic.filter(label='ANOMALO').count(),
-                'normal_records': total_traffic.filter(label='NORMAL').count(),
-                'unprocessed_records': total_traffic.filter(procesado=False).count(),
-            },
+            'totals': total_traffic.aggregate(
+                total_records=Count('id'),
+                anomalous_records=Count('id', filter=Q(label='ANOMALO')),
+                normal_records=Count('id', filter=Q(label='NORMAL')),
+                unprocessed_records=Count('id', filter=Q(procesado=False)),
+            ),
             'by_protocol': list(
                 total_traffic.values('protocol').annotate(
                     count=Count('id')
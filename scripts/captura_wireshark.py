@@ -1,18 +1,30 @@
 #!/usr/bin/env python3
 """
-Sistema de captura automática de tráfico con Wireshark/tshark
-Inicia captura después de 20 segundos del acceso inicial
+Sistema de captura automática de tráfico con Wireshark/dumpcap
+Inicia la captura con el primer acceso web o, como máximo, tras el delay
+(20 segundos por defecto). El aviso del acceso llega por la cache de Django,
+que debe ser compartida con el servidor web (Redis en producción)
 """
 
 import subprocess
+import shutil
+import queue
+import atexit
 import time
 import os
 import sys
 import threading
 import signal
 import logging
+import glob
+import errno
+import functools
+import mmap
+import struct
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 # Añadir el directorio raíz al path para importar Django
 sys.path.append(str(Path(__file__).parent.parent))
@@ -24,43 +36,146 @@ try:
     import django
     django.setup()
     
+    from django.conf import settings
+    from django.core.cache import cache
+    from django.db import transaction
+    from django.utils.timezone import now as _ahora
     from apps.core.models import SystemConfiguration
     from apps.traffic.models import CaptureSession
     from apps.core.utils import create_system_alert
 except ImportError as e:
     print(f"Error importando Django: {e}")
     print("Ejecutando en modo standalone")
+    _ahora = datetime.now
 
 # Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/var/log/traffic_capture.log'),
+# Los hilos solo encolan registros; un hilo de fondo hace la escritura
+if not logging.getLogger().handlers:
+    _log_handlers = [
+        RotatingFileHandler('/var/log/traffic_capture.log', maxBytes=64 * 1024 * 1024, backupCount=4),
         logging.StreamHandler()
     ]
-)
+    for _handler in _log_handlers:
+        _handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    _log_queue = queue.Queue(-1)
+    _queue_handler = QueueHandler(_log_queue)
+    _queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+    _log_listener = QueueListener(_log_queue, *_log_handlers)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
+# Capturas en disco: sin comprimir o comprimidas tras su conversión
+EXTENSIONES_PCAP = ('.pcap', '.pcap.zst')
+
+# Directorios de captura ya creados en este proceso
+_dirs_ready = set()
+
+# Transiciones sin alertas ni auditoría en las señales de CaptureSession,
+# que pueden escribirse con un UPDATE directo
+ESTADOS_SIN_SENALES = {'PENDING', 'RUNNING'}
+CAMPOS_UPDATE_DIRECTO = {'status', 'started_at', 'pcap_file_path', 'csv_file_path'}
+
+# Conversiones flow.js -> procesar_csv.py simultáneas; el resto de archivos
+# rotados espera turno en la cola del pool
+MAX_PROCESAMIENTOS = 2
+_pool_procesamiento = ThreadPoolExecutor(max_workers=MAX_PROCESAMIENTOS,
+                                         thread_name_prefix='procesamiento')
+
+
+def _now_tag():
+    """Marca de tiempo para nombres de sesión y archivo"""
+    return time.strftime("%Y%m%d_%H%M%S")
+
+
+def _eliminar_archivo(path):
+    """Elimina un archivo; devuelve True si se eliminó"""
+    try:
+        os.unlink(path)
+        return True
+    except OSError:
+        return False
+
+
+def _archivar_archivo(path, archive_dir):
+    """Mueve un archivo al archivo histórico; devuelve True si se movió"""
+    destino = os.path.join(archive_dir, os.path.basename(path))
+    try:
+        try:
+            # Mismo sistema de archivos: solo se reescribe la entrada de directorio
+            os.rename(path, destino)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # Entre sistemas de archivos copyfile copia en el kernel (sendfile)
+            shutil.copyfile(path, destino)
+            os.unlink(path)
+        return True
+    except OSError:
+        return False
+
+
+def _fadvise(path, advice):
+    """Aplica posix_fadvise a todo el archivo (sin efecto fuera de Linux).
+    
+    Solo tiene sentido para POSIX_FADV_DONTNEED, que actúa sobre la caché de
+    páginas compartida; las pistas de lectura valen únicamente para el fd que
+    las recibe.
+    """
+    if advice is None or not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, advice)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logger.debug(f"posix_fadvise no aplicado a {path}: {e}")
+
+
+def _get_cfg():
+    """Configuración del sistema cacheada 60 s entre capturas consecutivas"""
+    return cache.get_or_set('system_config', SystemConfiguration.get_current_config, 60)
+
 
 class CapturaTrafico:
     """Clase para manejar la captura de tráfico de red"""
     
-    def __init__(self, interface="eth0", duration=300, capture_dir=None):
+    def __init__(self, interface="eth0", duration=300, capture_dir=None, instalar_senales=True):
         self.interface = interface
         self.duration = duration
         self.capture_dir = capture_dir or "/media/captures/"
+        # Buffer del kernel (MB) y ring buffer de archivos (KB por archivo).
+        # -B dimensiona un ring segmentado por CPU, así que es preferible
+        # sobredimensionarlo: un buffer pequeño es la causa de paquetes perdidos
+        self.buffer_size = 64
+        self.ring_filesize = 262144
+        self.ring_files = 8
+        # Núcleo para dumpcap; None = último núcleo disponible
+        self.capture_cpu = None
         self.process = None
         self.session_id = None
         self.capture_session = None
         self.running = False
+        # Permite adelantar el inicio de la captura desde otro hilo
+        self._ready_event = threading.Event()
+        # Conversión y carga en BD al terminar la captura; sin keep_csv el CSV
+        # pasa de flow.js a procesar_csv.py por una tubería, sin tocar disco
+        self.auto_procesar = True
+        self.keep_csv = False
         
-        # Crear directorio si no existe
-        os.makedirs(self.capture_dir, exist_ok=True)
+        # Crear directorio si no existe (una sola vez por proceso)
+        if self.capture_dir not in _dirs_ready:
+            os.makedirs(self.capture_dir, exist_ok=True)
+            _dirs_ready.add(self.capture_dir)
         
-        # Configurar manejo de señales
-        signal.signal(signal.SIGINT, self.signal_handler)
-        signal.signal(signal.SIGTERM, self.signal_handler)
+        # Configurar manejo de señales; usada como librería (instalar_senales=False)
+        # las señales quedan en manos del proceso que la importa
+        if instalar_senales:
+            signal.signal(signal.SIGINT, self.signal_handler)
+            signal.signal(signal.SIGTERM, self.signal_handler)
     
     def signal_handler(self, sig, frame):
         """Maneja señales de interrupción"""
@@ -75,32 +190,37 @@ class CapturaTrafico:
             return False
         return True
     
-    def verificar_tshark(self):
-        """Verifica que tshark está instalado"""
+    def verificar_dumpcap(self):
+        """Verifica que dumpcap (backend de captura de tshark) está instalado"""
         try:
-            result = subprocess.run(['which', 'tshark'], 
-                                  capture_output=True, text=True)
-            if result.returncode == 0:
-                logger.info(f"tshark encontrado en: {result.stdout.strip()}")
+            path = shutil.which('dumpcap')
+            if path:
+                logger.info(f"dumpcap encontrado en: {path}")
                 return True
             else:
-                logger.error("tshark no encontrado. Instalar con: sudo apt-get install tshark")
+                logger.error("dumpcap no encontrado. Instalar con: sudo apt-get install tshark")
                 return False
         except Exception as e:
-            logger.error(f"Error verificando tshark: {e}")
+            logger.error(f"Error verificando dumpcap: {e}")
             return False
     
     def verificar_interfaz(self):
-        """Verifica que la interfaz de red existe"""
+        """Verifica que la interfaz de red existe y tiene enlace"""
         try:
-            result = subprocess.run(['ip', 'link', 'show', self.interface], 
-                                  capture_output=True, text=True)
-            if result.returncode == 0:
-                logger.info(f"Interfaz {self.interface} encontrada")
-                return True
-            else:
+            sysfs_dir = os.path.join('/sys/class/net', self.interface)
+            if not os.path.isdir(sysfs_dir):
                 logger.error(f"Interfaz {self.interface} no encontrada")
                 return False
+            
+            # Interfaces virtuales (tun, lo...) reportan 'unknown' aunque estén activas
+            with open(os.path.join(sysfs_dir, 'operstate')) as f:
+                operstate = f.read().strip()
+            if operstate not in ('up', 'unknown'):
+                logger.error(f"Interfaz {self.interface} sin enlace (estado: {operstate})")
+                return False
+            
+            logger.info(f"Interfaz {self.interface} encontrada (estado: {operstate})")
+            return True
         except Exception as e:
             logger.error(f"Error verificando interfaz: {e}")
             return False
@@ -108,9 +228,13 @@ class CapturaTrafico:
     def obtener_configuracion_sistema(self):
         """Obtiene configuración del sistema Django"""
         try:
-            config = SystemConfiguration.get_current_config()
+            config = _get_cfg()
             self.interface = config.network_interface
             self.duration = config.capture_duration
+            self.buffer_size = config.capture_buffer_size
+            self.ring_filesize = config.capture_ring_filesize
+            self.ring_files = config.capture_ring_files
+            self.capture_cpu = config.capture_cpu
             logger.info(f"Configuración cargada: interfaz={self.interface}, duración={self.duration}s")
         except Exception as e:
             logger.warning(f"No se pudo cargar configuración del sistema: {e}")
@@ -119,8 +243,7 @@ class CapturaTrafico:
     def crear_session_bd(self):
         """Crea sesión en base de datos"""
         try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            self.session_id = f"capture_{timestamp}"
+            self.session_id = f"capture_{_now_tag()}"
             
             self.capture_session = CaptureSession.objects.create(
                 session_id=self.session_id,
@@ -132,41 +255,135 @@ class CapturaTrafico:
         except Exception as e:
             logger.error(f"Error creando sesión en BD: {e}")
             # Continuar sin BD
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            self.session_id = f"capture_{timestamp}"
+            self.session_id = f"capture_{_now_tag()}"
     
     def actualizar_estado_session(self, status, **kwargs):
         """Actualiza estado de la sesión en BD"""
         try:
             if self.capture_session:
                 self.capture_session.status = status
+                fields = ['status']
                 for key, value in kwargs.items():
                     if hasattr(self.capture_session, key):
                         setattr(self.capture_session, key, value)
-                self.capture_session.save()
+                        fields.append(key)
+                if status in ESTADOS_SIN_SENALES and set(fields) <= CAMPOS_UPDATE_DIRECTO:
+                    # Sin efectos en señales: un único UPDATE, sin SELECT del pre_save
+                    CaptureSession.objects.filter(pk=self.capture_session.pk).update(
+                        **{field: getattr(self.capture_session, field) for field in fields}
+                    )
+                else:
+                    # Solo las columnas modificadas; las escrituras de las señales
+                    # post_save se confirman junto con la actualización
+                    with transaction.atomic():
+                        self.capture_session.save(update_fields=fields)
                 logger.debug(f"Estado de sesión actualizado: {status}")
         except Exception as e:
             logger.error(f"Error actualizando estado de sesión: {e}")
     
     def generar_nombre_archivo(self):
-        """Genera nombre único para archivo de captura"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"captura_{self.session_id}_{timestamp}.pcap"
+        """Genera el prefijo de archivo de captura.
+        
+        Con ring buffer dumpcap añade _NNNNN_<timestamp> a cada archivo rotado.
+        """
+        filename = f"captura_{self.session_id}.pcap"
         return os.path.join(self.capture_dir, filename)
     
+    def archivos_rotados(self, filepath):
+        """Lista los archivos PCAP rotados generados a partir de un prefijo"""
+        base, ext = os.path.splitext(filepath)
+        return sorted(glob.glob(f"{glob.escape(base)}_*{ext}"))
+    
+    def construir_comando(self, filepath, limitar_archivos=False):
+        """Construye el comando de captura para el prefijo indicado.
+        
+        Con limitar_archivos dumpcap conserva solo los ring_files más recientes
+        y borra los anteriores; solo tiene sentido si otro proceso los consume
+        mientras la captura sigue en curso.
+        """
+        # dumpcap: solo captura, sin el coste de los disectores de tshark
+        cmd = [
+            "dumpcap", 
+            "-i", self.interface,
+            "-a", f"duration:{self.duration}",
+            "-w", filepath,
+            "-B", str(self.buffer_size),  # Buffer del kernel en MB
+            "-b", f"filesize:{self.ring_filesize}",  # Rotar cada N KB
+            "-q",  # Modo silencioso
+            "-f", "not host 127.0.0.1"  # Excluir localhost
+        ]
+        if limitar_archivos:
+            cmd += ["-b", f"files:{self.ring_files}"]  # Conservar como máximo N archivos
+        return cmd
+    
+    @staticmethod
+    def numero_rotacion(pcap_file):
+        """Número de secuencia NNNNN que dumpcap añade a un archivo rotado"""
+        try:
+            return int(Path(pcap_file).stem.rsplit('_', 2)[1])
+        except (IndexError, ValueError):
+            return None
+    
+    def fijar_cpu_captura(self, pid):
+        """Fija dumpcap a un núcleo con prioridad SCHED_FIFO (requiere root)"""
+        if not hasattr(os, 'sched_setaffinity'):
+            return
+        try:
+            # Sin migraciones entre CPUs las colas de recepción por CPU se mantienen estables
+            cpu = self.capture_cpu
+            if cpu is None:
+                cpu = max(os.sched_getaffinity(0))
+            os.sched_setaffinity(pid, {cpu})
+            os.sched_setscheduler(pid, os.SCHED_FIFO, os.sched_param(50))
+            logger.info(f"dumpcap fijado a la CPU {cpu} con SCHED_FIFO")
+        except (OSError, ValueError) as e:
+            logger.warning(f"No se pudo fijar la CPU de captura: {e}")
+    
     def iniciar_captura_automatica(self, delay=20):
-        """Inicia captura después del delay especificado"""
-        logger.info(f"Esperando {delay} segundos antes de iniciar captura...")
-        time.sleep(delay)
+        """Inicia captura tras el acceso inicial o, como máximo, tras el delay"""
+        logger.info(f"Esperando acceso inicial (máximo {delay} segundos) antes de iniciar captura...")
+        motivo = self.esperar_acceso_inicial(delay)
+        logger.info(f"Iniciando captura: {motivo}")
         
         return self.capturar_trafico()
     
+    def esperar_acceso_inicial(self, delay):
+        """Espera la marca 'first_access_ts' del middleware con backoff exponencial.
+        
+        Solo cuenta un acceso de los últimos delay segundos. Con una cache local
+        (LocMemCache) la marca del servidor web no es visible y se espera el
+        delay completo.
+        """
+        try:
+            if settings.CACHES['default']['BACKEND'].endswith('LocMemCache'):
+                logger.warning("Cache local: el acceso web no es visible desde la captura, "
+                               "se espera el delay completo")
+        except Exception:
+            pass
+        
+        limite = time.monotonic() + delay
+        espera = 0.1
+        while True:
+            try:
+                acceso = cache.get('first_access_ts')
+                if acceso and time.time() - acceso <= delay:
+                    return "acceso inicial detectado"
+            except Exception:
+                pass  # Sin cache de Django (modo standalone): solo cuenta el delay
+            
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                return f"sin acceso inicial tras {delay} segundos"
+            if self._ready_event.wait(timeout=min(espera, restante)):
+                return "inicio solicitado"
+            espera *= 2
+    
     def capturar_trafico(self):
-        """Ejecuta tshark para capturar tráfico"""
+        """Ejecuta dumpcap para capturar tráfico"""
         if not self.verificar_permisos():
             return False
         
-        if not self.verificar_tshark():
+        if not self.verificar_dumpcap():
             return False
         
         if not self.verificar_interfaz():
@@ -181,76 +398,72 @@ class CapturaTrafico:
         # Generar archivo de salida
         filepath = self.generar_nombre_archivo()
         
-        # Comando tshark
-        cmd = [
-            "tshark", 
-            "-i", self.interface,
-            "-a", f"duration:{self.duration}",
-            "-w", filepath,
-            "-q",  # Modo silencioso
-            "-f", "not host 127.0.0.1"  # Excluir localhost
-        ]
+        cmd = self.construir_comando(filepath)
         
         logger.info(f"Iniciando captura con comando: {' '.join(cmd)}")
-        logger.info(f"Archivo de salida: {filepath}")
+        logger.info(f"Prefijo de archivos de salida: {filepath}")
         
         try:
             # Actualizar estado a running
             self.actualizar_estado_session('RUNNING', 
-                                         started_at=datetime.now(),
+                                         started_at=_ahora(),
                                          pcap_file_path=filepath)
             
             # Ejecutar captura
+            # dumpcap -q no escribe nada útil en stdout; solo se conserva stderr
             self.process = subprocess.Popen(
                 cmd,
-                stdout=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
                 stderr=subprocess.PIPE,
                 text=True
             )
             
             self.running = True
             logger.info(f"Captura iniciada (PID: {self.process.pid})")
+            self.fijar_cpu_captura(self.process.pid)
             
-            # Esperar a que termine
-            stdout, stderr = self.process.communicate(timeout=self.duration + 60)
+            # Esperar a que termine (communicate drena stderr mientras espera)
+            _, stderr = self.process.communicate(timeout=self.duration + 60)
             
             self.running = False
             
             if self.process.returncode == 0:
                 # Captura exitosa
-                if os.path.exists(filepath):
-                    file_size = os.path.getsize(filepath)
+                archivos = self.archivos_rotados(filepath)
+                if archivos:
+                    file_size = sum(os.path.getsize(f) for f in archivos)
                     
                     # Estimar número de paquetes
-                    estimated_packets = self.estimar_paquetes(filepath)
+                    estimated_packets = sum(self.estimar_paquetes(f) for f in archivos)
                     
                     logger.info(f"Captura completada exitosamente")
-                    logger.info(f"Archivo: {filepath}")
+                    logger.info(f"Archivos: {len(archivos)} ({', '.join(os.path.basename(f) for f in archivos)})")
                     logger.info(f"Tamaño: {file_size:,} bytes")
                     logger.info(f"Paquetes estimados: {estimated_packets:,}")
                     
                     # Actualizar estado en BD
                     self.actualizar_estado_session('COMPLETED',
-                                                 completed_at=datetime.now(),
+                                                 completed_at=_ahora(),
                                                  packets_captured=estimated_packets,
                                                  bytes_captured=file_size)
                     
                     # Iniciar procesamiento automático
-                    self.iniciar_procesamiento_automatico(filepath)
+                    for archivo in archivos:
+                        self.iniciar_procesamiento_automatico(archivo)
                     
-                    return filepath
+                    return archivos
                 else:
                     raise Exception("Archivo PCAP no fue creado")
             else:
-                error_msg = stderr or "Error desconocido en tshark"
-                raise Exception(f"Error en tshark (código {self.process.returncode}): {error_msg}")
+                error_msg = stderr or "Error desconocido en dumpcap"
+                raise Exception(f"Error en dumpcap (código {self.process.returncode}): {error_msg}")
                 
         except subprocess.TimeoutExpired:
             error_msg = f"Timeout en captura después de {self.duration + 60} segundos"
             logger.error(error_msg)
             self.detener_captura()
             self.actualizar_estado_session('FAILED', 
-                                         completed_at=datetime.now(),
+                                         completed_at=_ahora(),
                                          error_message=error_msg)
             return False
             
@@ -259,7 +472,7 @@ class CapturaTrafico:
             logger.error(error_msg)
             self.detener_captura()
             self.actualizar_estado_session('FAILED',
-                                         completed_at=datetime.now(),
+                                         completed_at=_ahora(),
                                          error_message=error_msg)
             
             # Crear alerta de error
@@ -295,14 +508,19 @@ class CapturaTrafico:
                 
                 # Actualizar estado
                 self.actualizar_estado_session('CANCELLED',
-                                             completed_at=datetime.now())
+                                             completed_at=_ahora())
                 
             except Exception as e:
                 logger.error(f"Error deteniendo captura: {e}")
     
     def estimar_paquetes(self, filepath):
-        """Estima el número de paquetes usando capinfos"""
+        """Estima el número de paquetes leyendo las cabeceras o usando capinfos"""
         try:
+            paquetes = self._contar_paquetes_mmap(filepath)
+            if paquetes is not None:
+                return paquetes
+            
+            # Formato desconocido: delegar en capinfos
             result = subprocess.run(['capinfos', '-c', filepath], 
                                   capture_output=True, text=True)
             
@@ -320,12 +538,66 @@ class CapturaTrafico:
             file_size = os.path.getsize(filepath)
             return file_size // 100
     
+    @staticmethod
+    def _contar_paquetes_mmap(filepath):
+        """Cuenta paquetes saltando de cabecera en cabecera sin leer payloads.
+        
+        Soporta pcap (µs/ns, ambos endianness) y pcapng. Devuelve None si el
+        formato no se reconoce.
+        """
+        with open(filepath, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return 0
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                size = len(mm)
+                magic = mm[:4]
+                
+                if magic == b'\x0a\x0d\x0d\x0a':
+                    return CapturaTrafico._contar_bloques_pcapng(mm)
+                if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+                    fmt = '<I'
+                elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+                    fmt = '>I'
+                else:
+                    return None
+                
+                # Cabecera global de 24 bytes; cada registro tiene 16 bytes de
+                # cabecera con incl_len en el offset 8
+                paquetes = 0
+                offset = 24
+                while offset + 16 <= size:
+                    incl_len = struct.unpack_from(fmt, mm, offset + 8)[0]
+                    offset += 16 + incl_len
+                    if offset > size:
+                        break  # Último registro truncado
+                    paquetes += 1
+                return paquetes
+    
+    @staticmethod
+    def _contar_bloques_pcapng(mm):
+        """Cuenta bloques de paquete (EPB, SPB y PB obsoleto) de un pcapng"""
+        size = len(mm)
+        fmt = '<II'
+        paquetes = 0
+        offset = 0
+        while offset + 12 <= size:
+            # Cada Section Header Block define el endianness de su sección
+            if mm[offset:offset + 4] == b'\x0a\x0d\x0d\x0a':
+                fmt = '<II' if mm[offset + 8:offset + 12] == b'\x4d\x3c\x2b\x1a' else '>II'
+            block_type, block_len = struct.unpack_from(fmt, mm, offset)
+            if block_len < 12 or offset + block_len > size:
+                break
+            if block_type in (2, 3, 6):
+                paquetes += 1
+            offset += block_len
+        return paquetes
+    
     def iniciar_procesamiento_automatico(self, pcap_filepath):
         """Inicia procesamiento automático del PCAP"""
         try:
             # Verificar configuración automática
-            config = SystemConfiguration.get_current_config()
-            if not config.auto_process_csv:
+            config = _get_cfg()
+            if not self.auto_procesar or not config.auto_process_csv:
                 logger.info("Procesamiento automático deshabilitado")
                 return
             
@@ -334,30 +606,72 @@ class CapturaTrafico:
             # Ejecutar script de conversión
             flow_script = os.path.join(os.path.dirname(__file__), 'flow.js')
             if os.path.exists(flow_script):
-                subprocess.Popen(['node', flow_script, pcap_filepath])
-                logger.info("Script de conversión iniciado")
+                _pool_procesamiento.submit(self._ejecutar_procesamiento, flow_script, pcap_filepath)
             else:
                 logger.warning("Script flow.js no encontrado")
                 
         except Exception as e:
             logger.error(f"Error iniciando procesamiento automático: {e}")
     
-    def limpiar_archivos_antiguos(self, dias=7):
-        """Limpia archivos PCAP antiguos"""
+    def _ejecutar_procesamiento(self, flow_script, pcap_filepath):
+        """Convierte y carga un PCAP en un hilo del pool, esperando a sus procesos"""
+        try:
+            if self.keep_csv:
+                procesos = [subprocess.Popen(['node', flow_script, pcap_filepath])]
+                logger.info(f"Script de conversión iniciado: {pcap_filepath}")
+            else:
+                conversor = subprocess.Popen(
+                    ['node', flow_script, '--input', pcap_filepath, '--stdout'],
+                    stdout=subprocess.PIPE
+                )
+                procesador = subprocess.Popen(
+                    [sys.executable, os.path.join(os.path.dirname(__file__), 'procesar_csv.py'),
+                     '--stdin', '--origen', f"{Path(pcap_filepath).stem}.csv"],
+                    stdin=conversor.stdout
+                )
+                # Solo procesar_csv.py debe conservar el extremo de lectura
+                conversor.stdout.close()
+                procesos = [conversor, procesador]
+                logger.info(f"Conversión y procesamiento iniciados (tubería flow.js -> procesar_csv.py): {pcap_filepath}")
+            
+            for proceso in procesos:
+                if proceso.wait() != 0:
+                    logger.error(f"Procesamiento de {pcap_filepath} falló: {proceso.args[0]} "
+                                 f"terminó con código {proceso.returncode}")
+            
+            # Terminada la conversión el PCAP ya no se vuelve a leer: liberar sus
+            # páginas de la caché para la siguiente captura. Los hilos del pool no
+            # son daemon, así que al salir el intérprete espera a que llegue aquí
+            _fadvise(pcap_filepath, getattr(os, 'POSIX_FADV_DONTNEED', None))
+                
+        except Exception as e:
+            logger.error(f"Error procesando {pcap_filepath}: {e}")
+    
+    def limpiar_archivos_antiguos(self, dias=7, archive_dir=None):
+        """Limpia archivos PCAP antiguos; con archive_dir los archiva en lugar de borrarlos"""
         try:
-            import time
             cutoff_time = time.time() - (dias * 24 * 3600)
             
-            archivos_eliminados = 0
-            for filename in os.listdir(self.capture_dir):
-                if filename.endswith('.pcap'):
-                    filepath = os.path.join(self.capture_dir, filename)
-                    if os.path.getmtime(filepath) < cutoff_time:
-                        os.remove(filepath)
-                        archivos_eliminados += 1
-                        logger.info(f"Archivo antiguo eliminado: {filename}")
+            # scandir devuelve el stat cacheado de cada entrada
+            with os.scandir(self.capture_dir) as entries:
+                candidatos = [
+                    entry.path for entry in entries
+                    if entry.name.endswith(EXTENSIONES_PCAP) and entry.stat().st_mtime < cutoff_time
+                ]
+            
+            if archive_dir:
+                os.makedirs(archive_dir, exist_ok=True)
+                operacion = functools.partial(_archivar_archivo, archive_dir=archive_dir)
+                accion = f"archivados en {archive_dir}"
+            else:
+                operacion = _eliminar_archivo
+                accion = "eliminados"
+            
+            # Los unlink/rename se solapan en varios hilos
+            with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+                completados = sum(executor.map(operacion, candidatos))
             
-            logger.info(f"Limpieza completada: {archivos_eliminados} archivos eliminados")
+            logger.info(f"Limpieza completada: {completados} de {len(candidatos)} archivos {accion}")
             
         except Exception as e:
             logger.error(f"Error en limpieza de archivos: {e}")
@@ -365,13 +679,11 @@ class CapturaTrafico:
     def obtener_estadisticas(self):
         """Obtiene estadísticas de capturas"""
         try:
-            archivos_pcap = [f for f in os.listdir(self.capture_dir) if f.endswith('.pcap')]
+            with os.scandir(self.capture_dir) as entries:
+                tamaños = [e.stat().st_size for e in entries if e.name.endswith(EXTENSIONES_PCAP)]
             
-            total_archivos = len(archivos_pcap)
-            total_tamaño = sum(
-                os.path.getsize(os.path.join(self.capture_dir, f)) 
-                for f in archivos_pcap
-            )
+            total_archivos = len(tamaños)
+            total_tamaño = sum(tamaños)
             
             logger.info(f"Estadísticas de captura:")
             logger.info(f"- Total archivos PCAP: {total_archivos}")
@@ -389,7 +701,7 @@ class CapturaTrafico:
 
 
 def main():
-    """Función principal"""
+    """Función principal. Devuelve los PCAP capturados o False si falla"""
     import argparse
     
     parser = argparse.ArgumentParser(description='Sistema de captura de tráfico de red')
@@ -405,8 +717,12 @@ def main():
                        help='Iniciar inmediatamente sin delay')
     parser.add_argument('--cleanup', action='store_true',
                        help='Limpiar archivos antiguos y salir')
+    parser.add_argument('--archive-dir',
+                       help='Con --cleanup, mover los archivos antiguos a este directorio')
     parser.add_argument('--stats', action='store_true',
                        help='Mostrar estadísticas y salir')
+    parser.add_argument('--keep-csv', action='store_true',
+                       help='Guardar el CSV en disco en el procesamiento automático')
     
     args = parser.parse_args()
     
@@ -416,10 +732,11 @@ def main():
         duration=args.duration,
         capture_dir=args.output_dir
     )
+    captura.keep_csv = args.keep_csv
     
     # Ejecutar acción solicitada
     if args.cleanup:
-        captura.limpiar_archivos_antiguos()
+        captura.limpiar_archivos_antiguos(archive_dir=args.archive_dir)
         return
     
     if args.stats:
@@ -434,11 +751,11 @@ def main():
     
     if resultado:
         logger.info(f"Captura completada exitosamente: {resultado}")
-        sys.exit(0)
     else:
         logger.error("La captura falló")
-        sys.exit(1)
+    
+    return resultado
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(1 if main() is False else 0)
\ No newline at end of file
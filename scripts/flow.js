@@ -7,11 +7,14 @@
 const { exec, spawn } = require('child_process');
 const fs = require('fs');
 const path = require('path');
+const readline = require('readline');
 const { promisify } = require('util');
 const execAsync = promisify(exec);
 
 class FlowProcessor {
-    constructor() {
+    constructor(options = {}) {
+        // Con stdoutMode el CSV sale por stdout y los mensajes van a stderr
+        this.stdoutMode = options.stdoutMode || false;
         this.inputDir = '/media/captures/';
         this.outputDir = '/media/csv_files/';
         this.processedDir = path.join(this.outputDir, 'processed');
@@ -35,7 +38,11 @@ class FlowProcessor {
         const timestamp = new Date().toISOString();
         const logMessage = `${timestamp} - ${message}\n`;
         
-        console.log(message);
+        if (this.stdoutMode) {
+            console.error(message);
+        } else {
+            console.log(message);
+        }
         
         try {
             fs.appendFileSync(this.logFile, logMessage);
@@ -91,6 +98,47 @@ class FlowProcessor {
         }
     }
 
+    buildTsharkFields() {
+        // Campos relevantes que extrae tshark
+        const fields = [
+            'ip.src',           // IP origen
+            'ip.dst',           // IP destino  
+            'tcp.srcport',      // Puerto TCP origen
+            'tcp.dstport',      // Puerto TCP destino
+            'udp.srcport',      // Puerto UDP origen
+            'udp.dstport',      // Puerto UDP destino
+            'frame.protocols',  // Protocolos
+            'frame.len',        // Longitud del frame
+            'frame.time_relative', // Tiempo relativo
+            'tcp.flags',        // Flags TCP
+            'ip.proto',         // Protocolo IP
+            'frame.number',     // Número de frame
+            'ip.len',           // Longitud IP
+            'tcp.len',          // Longitud TCP
+            'udp.length'        // Longitud UDP
+        ];
+
+        return fields;
+    }
+
+    buildTsharkArgs(pcapFile) {
+        // Argumentos de tshark sin shell, un -e por campo
+        const fields = this.buildTsharkFields();
+        return [
+            '-r', pcapFile,
+            '-T', 'fields',
+            ...fields.flatMap(field => ['-e', field]),
+            '-E', 'header=y',
+            '-E', 'separator=,',
+            '-E', 'quote=d',
+            '-E', 'occurrence=f'
+        ];
+    }
+
+    buildTsharkCommand(pcapFile) {
+        return ['tshark', ...this.buildTsharkArgs(pcapFile)].join(' ');
+    }
+
     async processPcapToCSV(pcapFile, outputFile = null) {
         try {
             this.log(`Iniciando procesamiento de ${pcapFile}`);
@@ -110,35 +158,7 @@ class FlowProcessor {
             const packetInfo = await this.getPacketInfo(pcapFile);
             this.log(`PCAP info - Paquetes: ${packetInfo.packets}, Tamaño: ${packetInfo.size} bytes, Duración: ${packetInfo.duration}s`);
 
-            // Comando tshark para extraer campos relevantes
-            const fields = [
-                'ip.src',           // IP origen
-                'ip.dst',           // IP destino  
-                'tcp.srcport',      // Puerto TCP origen
-                'tcp.dstport',      // Puerto TCP destino
-                'udp.srcport',      // Puerto UDP origen
-                'udp.dstport',      // Puerto UDP destino
-                'frame.protocols',  // Protocolos
-                'frame.len',        // Longitud del frame
-                'frame.time_relative', // Tiempo relativo
-                'tcp.flags',        // Flags TCP
-                'ip.proto',         // Protocolo IP
-                'frame.number',     // Número de frame
-                'ip.len',           // Longitud IP
-                'tcp.len',          // Longitud TCP
-                'udp.length'        // Longitud UDP
-            ];
-
-            const tsharkCommand = [
-                'tshark',
-                '-r', pcapFile,
-                '-T', 'fields',
-                '-e', fields.join(' -e '),
-                '-E', 'header=y',
-                '-E', 'separator=,',
-                '-E', 'quote=d',
-                '-E', 'occurrence=f'
-            ].join(' ');
+            const tsharkCommand = this.buildTsharkCommand(pcapFile);
 
             this.log(`Ejecutando: ${tsharkCommand}`);
 
@@ -175,70 +195,113 @@ class FlowProcessor {
         }
     }
 
-    async cleanAndNormalizeCSV(csvFile) {
+    async streamPcapToStdout(pcapFile) {
         try {
-            this.log(`Limpiando y normalizando CSV: ${csvFile}`);
-
-            // Leer archivo CSV
-            const csvContent = fs.readFileSync(csvFile, 'utf8');
-            const lines = csvContent.split('\n');
+            this.log(`Iniciando procesamiento de ${pcapFile} hacia stdout`);
 
-            if (lines.length < 2) {
-                throw new Error('CSV vacío o sin datos');
+            // Verificar que el archivo existe
+            if (!fs.existsSync(pcapFile)) {
+                throw new Error(`Archivo PCAP no encontrado: ${pcapFile}`);
             }
 
-            // Procesar header
-            const header = lines[0].split(',').map(field => field.replace(/"/g, '').trim());
-            
-            // Mapear campos a nombres estándar
-            const fieldMapping = {
-                'ip.src': 'src_ip',
-                'ip.dst': 'dst_ip',
-                'tcp.srcport': 'src_port',
-                'tcp.dstport': 'dst_port',
-                'udp.srcport': 'src_port_udp',
-                'udp.dstport': 'dst_port_udp',
-                'frame.len': 'packet_size',
-                'frame.time_relative': 'relative_time',
-                'tcp.flags': 'tcp_flags',
-                'ip.proto': 'protocol_num',
-                'frame.protocols': 'protocols',
-                'ip.len': 'ip_length',
-                'tcp.len': 'tcp_length',
-                'udp.length': 'udp_length'
+            const tsharkArgs = this.buildTsharkArgs(pcapFile);
+            this.log(`Ejecutando: tshark ${tsharkArgs.join(' ')}`);
+
+            // Cada línea de tshark se normaliza y se escribe en stdout según
+            // llega, sin acumular la salida completa en memoria
+            const { validRows, skippedRows } = await this.streamTsharkLines(tsharkArgs);
+
+            this.log(`CSV enviado a stdout: ${validRows} filas válidas, ${skippedRows} filas omitidas`);
+
+            return {
+                success: true,
+                inputFile: pcapFile,
+                rows: validRows
             };
 
-            // Crear nuevo header normalizado
-            const normalizedHeader = header.map(field => fieldMapping[field] || field);
-            
-            // Procesar datos
-            const processedLines = [normalizedHeader.join(',')];
-            let validRows = 0;
-            let skippedRows = 0;
+        } catch (error) {
+            this.log(`Error procesando PCAP: ${error.message}`);
+            throw error;
+        }
+    }
 
-            for (let i = 1; i < lines.length; i++) {
-                const line = lines[i].trim();
-                if (!line) continue;
+    async streamTsharkLines(tsharkArgs) {
+        const tshark = spawn('tshark', tsharkArgs, { stdio: ['ignore', 'pipe', 'pipe'] });
 
-                const fields = this.parseCSVLine(line);
-                if (fields.length !== header.length) {
-                    skippedRows++;
+        let stderr = '';
+        tshark.stderr.setEncoding('utf8');
+        tshark.stderr.on('data', chunk => { stderr += chunk; });
+
+        let spawnError = null;
+        tshark.on('error', error => { spawnError = error; });
+        const exited = new Promise(resolve => tshark.on('close', resolve));
+
+        const lines = readline.createInterface({ input: tshark.stdout, crlfDelay: Infinity });
+        let header = null;
+        let validRows = 0;
+        let skippedRows = 0;
+
+        try {
+            for await (const line of lines) {
+                if (header === null) {
+                    const parsed = this.normalizeHeader(line);
+                    header = parsed.header;
+                    await this.writeStdout(parsed.normalizedHeader.join(','));
                     continue;
                 }
 
-                // Procesar y validar campos
-                const processedFields = this.processFields(fields, header);
-                
-                if (this.isValidRow(processedFields)) {
-                    processedLines.push(processedFields.join(','));
-                    validRows++;
-                } else {
+                if (!line.trim()) continue;
+
+                const row = this.normalizeDataLine(line, header);
+                if (row === null) {
                     skippedRows++;
+                    continue;
                 }
+
+                await this.writeStdout('\n' + row);
+                validRows++;
             }
+        } catch (error) {
+            tshark.kill();
+            throw error;
+        }
+
+        const code = await exited;
+
+        if (spawnError) {
+            throw spawnError;
+        }
+        if (stderr.trim()) {
+            this.log(`Advertencias de tshark: ${stderr}`);
+        }
+        if (code !== 0) {
+            throw new Error(`tshark terminó con código ${code}`);
+        }
+        if (header === null || validRows + skippedRows === 0) {
+            throw new Error('CSV vacío o sin datos');
+        }
+
+        return { validRows, skippedRows };
+    }
+
+    writeStdout(text) {
+        // Respeta la contrapresión de la tubería hacia procesar_csv.py
+        if (process.stdout.write(text)) {
+            return Promise.resolve();
+        }
+        return new Promise(resolve => process.stdout.once('drain', resolve));
+    }
+
+    async cleanAndNormalizeCSV(csvFile) {
+        try {
+            this.log(`Limpiando y normalizando CSV: ${csvFile}`);
+
+            // Leer archivo CSV
+            const csvContent = fs.readFileSync(csvFile, 'utf8');
+            const { content, validRows, skippedRows } = this.normalizeCSVContent(csvContent);
 
             // Escribir archivo limpio
-            fs.writeFileSync(csvFile, processedLines.join('\n'));
+            fs.writeFileSync(csvFile, content);
             
             this.log(`CSV procesado: ${validRows} filas válidas, ${skippedRows} filas omitidas`);
 
@@ -248,6 +311,81 @@ class FlowProcessor {
         }
     }
 
+    normalizeCSVContent(csvContent) {
+        const lines = csvContent.split('\n');
+
+        if (lines.length < 2) {
+            throw new Error('CSV vacío o sin datos');
+        }
+
+        const { header, normalizedHeader } = this.normalizeHeader(lines[0]);
+        
+        // Procesar datos
+        const processedLines = [normalizedHeader.join(',')];
+        let validRows = 0;
+        let skippedRows = 0;
+
+        for (let i = 1; i < lines.length; i++) {
+            const line = lines[i].trim();
+            if (!line) continue;
+
+            const row = this.normalizeDataLine(line, header);
+            if (row === null) {
+                skippedRows++;
+            } else {
+                processedLines.push(row);
+                validRows++;
+            }
+        }
+
+        return {
+            content: processedLines.join('\n'),
+            validRows,
+            skippedRows
+        };
+    }
+
+    normalizeHeader(headerLine) {
+        // Procesar header
+        const header = headerLine.split(',').map(field => field.replace(/"/g, '').trim());
+        
+        // Mapear campos a nombres estándar
+        const fieldMapping = {
+            'ip.src': 'src_ip',
+            'ip.dst': 'dst_ip',
+            'tcp.srcport': 'src_port',
+            'tcp.dstport': 'dst_port',
+            'udp.srcport': 'src_port_udp',
+            'udp.dstport': 'dst_port_udp',
+            'frame.len': 'packet_size',
+            'frame.time_relative': 'relative_time',
+            'tcp.flags': 'tcp_flags',
+            'ip.proto': 'protocol_num',
+            'frame.protocols': 'protocols',
+            'ip.len': 'ip_length',
+            'tcp.len': 'tcp_length',
+            'udp.length': 'udp_length'
+        };
+
+        // Crear nuevo header normalizado
+        const normalizedHeader = header.map(field => fieldMapping[field] || field);
+
+        return { header, normalizedHeader };
+    }
+
+    normalizeDataLine(line, header) {
+        // Devuelve la fila normalizada o null si debe omitirse
+        const fields = this.parseCSVLine(line.trim());
+        if (fields.length !== header.length) {
+            return null;
+        }
+
+        // Procesar y validar campos
+        const processedFields = this.processFields(fields, header);
+        
+        return this.isValidRow(processedFields) ? processedFields.join(',') : null;
+    }
+
     parseCSVLine(line) {
         const fields = [];
         let current = '';
@@ -491,6 +629,7 @@ Uso: node flow.js [opciones] [archivo_pcap]
 Opciones:
   --input <archivo>    Archivo PCAP específico a procesar
   --output <archivo>   Archivo CSV de salida
+  --stdout            Escribir el CSV en stdout en lugar de en disco
   --all               Procesar todos los archivos PCAP pendientes
   --stats             Mostrar estadísticas
   --help, -h          Mostrar esta ayuda
@@ -499,12 +638,14 @@ Ejemplos:
   node flow.js --all                           # Procesar todos los archivos
   node flow.js --input capture.pcap           # Procesar archivo específico
   node flow.js --input capture.pcap --output output.csv  # Con salida específica
+  node flow.js --input capture.pcap --stdout  # CSV por stdout (para tuberías)
   node flow.js --stats                        # Mostrar estadísticas
         `);
         return;
     }
 
-    const processor = new FlowProcessor();
+    const stdoutMode = args.includes('--stdout');
+    const processor = new FlowProcessor({ stdoutMode });
 
     try {
         // Verificar dependencias
@@ -525,6 +666,12 @@ Ejemplos:
 
         if (inputIndex !== -1 && inputIndex + 1 < args.length) {
             const inputFile = args[inputIndex + 1];
+
+            if (stdoutMode) {
+                await processor.streamPcapToStdout(inputFile);
+                return;
+            }
+
             const outputFile = outputIndex !== -1 && outputIndex + 1 < args.length 
                 ? args[outputIndex + 1] 
                 : null;
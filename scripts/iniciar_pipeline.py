@@ -7,24 +7,44 @@ Ejecuta la secuencia completa: captura -> conversión -> procesamiento -> predic
 import os
 import sys
 import time
+import queue
 import threading
 import logging
+import atexit
 import subprocess
+import shutil
 import argparse
 from datetime import datetime
+from pathlib import Path
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 # Add project root to Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Output directory used by flow.js for generated CSV files
+CSV_OUTPUT_DIR = '/media/csv_files/'
+
+# Seconds between dependency revalidations in continuous mode
+DEPENDENCY_CHECK_TTL = 3600
+
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/var/log/anomalia_pipeline.log'),
+# Records are only queued by callers; a background thread does the I/O
+if not logging.getLogger().handlers:
+    _log_handlers = [
+        RotatingFileHandler('/var/log/anomalia_pipeline.log', maxBytes=64 * 1024 * 1024, backupCount=4),
         logging.StreamHandler()
     ]
-)
+    for _handler in _log_handlers:
+        _handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    _log_queue = queue.Queue(-1)
+    _queue_handler = QueueHandler(_log_queue)
+    _queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    logging.basicConfig(level=logging.INFO, handlers=[_queue_handler])
+    _log_listener = QueueListener(_log_queue, *_log_handlers)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
 
@@ -37,75 +57,115 @@ class PipelineAutomatizado:
             'capture_duration': 300,
             'capture_delay': 20,
             'auto_cleanup': True,
-            'max_file_age_days': 7
+            'max_file_age_days': 7,
+            'keep_uncompressed': False
         }
         self.is_running = False
         self.capture_thread = None
+        self._deps = {}
+        self._deps_ok = False
+        self._deps_checked_at = None
         
     def verificar_dependencias(self):
         """Verify all required dependencies are available"""
+        # Resolving the executables on PATH is enough; revalidate at most
+        # once per DEPENDENCY_CHECK_TTL instead of forking each binary per run
+        if (self._deps_checked_at is not None
+                and time.monotonic() - self._deps_checked_at < DEPENDENCY_CHECK_TTL):
+            return self._deps_ok
+        
         dependencies = {
-            'tshark': ['tshark', '--version'],
-            'node': ['node', '--version'],
-            'python': ['python3', '--version']
+            'tshark': 'tshark',
+            'node': 'node',
+            'python': 'python3'
         }
         
-        missing = []
-        for name, cmd in dependencies.items():
-            try:
-                result = subprocess.run(cmd, capture_output=True, text=True)
-                if result.returncode != 0:
-                    missing.append(name)
-                else:
-                    logger.info(f"{name} is available")
-            except FileNotFoundError:
-                missing.append(name)
+        self._deps = {name: shutil.which(cmd) for name, cmd in dependencies.items()}
+        missing = [name for name, path in self._deps.items() if not path]
+        
+        self._deps_ok = not missing
         
         if missing:
+            # Not cached: a later run may find them once installed
+            self._deps_checked_at = None
             logger.error(f"Missing dependencies: {', '.join(missing)}")
-            return False
+        else:
+            self._deps_checked_at = time.monotonic()
+            logger.info(f"Dependencies available: {', '.join(self._deps)}")
         
-        return True
+        return self._deps_ok
     
     def ejecutar_captura(self):
         """Execute traffic capture step"""
         logger.info("Step 1: Starting traffic capture...")
         
-        cmd = [
-            'python3', 'scripts/captura_wireshark.py',
-            '--interface', self.config['interface'],
-            '--duration', str(self.config['capture_duration']),
-            '--delay', str(self.config['capture_delay'])
-        ]
-        
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode == 0:
-                logger.info("Traffic capture completed successfully")
+            # Run the capture in-process instead of paying a fresh interpreter
+            # and Django setup for a child python3 process
+            from scripts.captura_wireshark import CapturaTrafico
+
+            # The pipeline keeps its own SIGINT/KeyboardInterrupt handling
+            captura = CapturaTrafico(
+                interface=self.config['interface'],
+                duration=self.config['capture_duration'],
+                instalar_senales=False
+            )
+            # Conversion and loading are the pipeline's own next steps
+            captura.auto_procesar = False
+            try:
+                pcap_files = captura.iniciar_captura_automatica(self.config['capture_delay'])
+            except KeyboardInterrupt:
+                # Without its signal handler the capture is stopped here, then
+                # the interrupt reaches the pipeline's own handling
+                captura.detener_captura()
+                raise
+            if pcap_files:
+                logger.info(f"Traffic capture completed successfully: {len(pcap_files)} PCAP files")
                 return True
             else:
-                logger.error(f"Capture failed: {result.stderr}")
+                logger.error("Capture failed")
                 return False
         except Exception as e:
             logger.error(f"Error in capture step: {e}")
             return False
     
+    def ejecutar_node(self, *args):
+        """Run scripts/flow.js with the given arguments"""
+        # An absolute executable with no cwd/close_fds lets subprocess launch
+        # node through os.posix_spawn (vfork) instead of fork+exec. stdout is
+        # progress chatter only; stderr is kept for error reporting.
+        node = shutil.which('node') or 'node'
+        cmd = [node, os.path.join(SCRIPTS_DIR, 'flow.js'), *args]
+        return subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                              text=True, close_fds=False)
+    
+    def comprimir_pcap(self, pcap_file):
+        """Compress a converted PCAP to .pcap.zst in the background"""
+        if self.config.get('keep_uncompressed', False):
+            return None
+        zstd = shutil.which('zstd')
+        if not zstd:
+            return None
+        # --rm drops the raw file once the compressed copy is complete
+        return subprocess.Popen([zstd, '-T0', '-3', '--long=27', '--rm', '-q', pcap_file],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                close_fds=False)
+    
     def ejecutar_conversion(self):
         """Execute PCAP to CSV conversion step"""
         logger.info("Step 2: Converting PCAP to CSV...")
         
-        cmd = ['node', 'scripts/flow.js', '--all']
-        
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, cwd='.')
+            result = self.ejecutar_node('--all')
             if result.returncode == 0:
-                logger.info("PCAP to CSV conversion completed")
+                csv_files = list(Path(CSV_OUTPUT_DIR).glob('*.csv'))
+                logger.info(f"PCAP to CSV conversion completed ({len(csv_files)} CSV files pending)")
                 return True
             else:
-                logger.warning("Conversion had issues, generating synthetic data...")
+                logger.warning(f"Conversion had issues: {result.stderr.strip()}")
+                logger.warning("Generating synthetic data...")
                 # Generate synthetic data as fallback
-                cmd_synthetic = ['node', 'scripts/flow.js', '--synthetic']
-                result = subprocess.run(cmd_synthetic, capture_output=True, text=True, cwd='.')
+                result = self.ejecutar_node('--synthetic')
                 return result.returncode == 0
         except Exception as e:
             logger.error(f"Error in conversion step: {e}")
@@ -115,16 +175,13 @@ class PipelineAutomatizado:
         """Execute CSV processing and database insertion"""
         logger.info("Step 3: Processing CSV data...")
         
-        cmd = ['python3', 'scripts/procesar_csv.py', '--all']
-        
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode == 0:
-                logger.info("CSV processing completed")
-                return True
-            else:
-                logger.error(f"Processing failed: {result.stderr}")
-                return False
+            # Runs in-process, reusing the already initialized Django registry
+            from scripts.procesar_csv import ProcesadorCSV
+            
+            resultado = ProcesadorCSV().procesar_todos_csv()
+            logger.info(f"CSV processing completed: {resultado}")
+            return True
         except Exception as e:
             logger.error(f"Error in processing step: {e}")
             return False
@@ -133,16 +190,12 @@ class PipelineAutomatizado:
         """Execute ML prediction step"""
         logger.info("Step 4: Running ML predictions...")
         
-        cmd = ['python3', 'scripts/predecir_csv.py', '--predict']
-        
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode == 0:
-                logger.info("ML predictions completed")
-                return True
-            else:
-                logger.error(f"Prediction failed: {result.stderr}")
-                return False
+            from scripts.predecir_csv import PredictorAnomalias
+            
+            registros = PredictorAnomalias().predecir_anomalias()
+            logger.info(f"ML predictions completed: {registros} records processed")
+            return True
         except Exception as e:
             logger.error(f"Error in prediction step: {e}")
             return False
@@ -156,11 +209,12 @@ class PipelineAutomatizado:
         
         try:
             # Clean old capture files
-            cmd_clean = [
-                'python3', 'scripts/captura_wireshark.py', 
-                '--clean'
-            ]
-            subprocess.run(cmd_clean, capture_output=True)
+            from scripts.captura_wireshark import CapturaTrafico
+            
+            CapturaTrafico(instalar_senales=False).limpiar_archivos_antiguos(
+                dias=self.config.get('max_file_age_days', 7),
+                archive_dir=self.config.get('archive_dir')
+            )
             
             logger.info("File cleanup completed")
             
@@ -200,9 +254,6 @@ class PipelineAutomatizado:
                     logger.info(f"✓ {step_name} completed successfully")
                 else:
                     logger.error(f"✗ {step_name} failed")
-                    
-                # Small delay between steps
-                time.sleep(2)
                 
             except Exception as e:
                 logger.error(f"✗ {step_name} failed with exception: {e}")
@@ -228,6 +279,138 @@ class PipelineAutomatizado:
         
         return success
     
+    def ejecutar_pipeline_streaming(self):
+        """Execute the pipeline overlapping all stages on rotated PCAP files"""
+        logger.info("Starting streaming pipeline")
+        
+        from scripts.captura_wireshark import CapturaTrafico
+        from django.utils import timezone
+        
+        captura = CapturaTrafico(
+            interface=self.config['interface'],
+            duration=self.config['capture_duration'],
+            instalar_senales=False
+        )
+        if not (captura.verificar_permisos() and captura.verificar_dumpcap()
+                and captura.verificar_interfaz()):
+            logger.error("Streaming pipeline aborted: capture prerequisites not met")
+            return False
+        
+        captura.obtener_configuracion_sistema()
+        captura.crear_session_bd()
+        prefijo = captura.generar_nombre_archivo()
+        
+        pcap_queue = queue.Queue()
+        csv_queue = queue.Queue()
+        prediction_queue = queue.Queue()
+        workers = [
+            threading.Thread(target=self._worker_conversion, args=(pcap_queue, csv_queue)),
+            threading.Thread(target=self._worker_procesamiento, args=(csv_queue, prediction_queue)),
+            threading.Thread(target=self._worker_prediccion, args=(prediction_queue,))
+        ]
+        for worker in workers:
+            worker.start()
+        
+        captura.actualizar_estado_session('RUNNING',
+                                          started_at=timezone.now(),
+                                          pcap_file_path=prefijo)
+        process = subprocess.Popen(captura.construir_comando(prefijo, limitar_archivos=True),
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+        logger.info(f"Capture started (PID: {process.pid})")
+        captura.fijar_cpu_captura(process.pid)
+        
+        # dumpcap keeps writing the newest ring file; every older one is closed
+        # and can be handed to the converter while the capture goes on
+        queued = set()
+        last_sequence = 0
+        try:
+            while True:
+                finished = process.poll() is not None
+                pcap_files = captura.archivos_rotados(prefijo)
+                closed_files = pcap_files if finished else pcap_files[:-1]
+                for pcap_file in closed_files:
+                    if pcap_file not in queued:
+                        # dumpcap deletes the oldest ring file once it keeps
+                        # ring_files of them; a gap means some were never queued
+                        sequence = captura.numero_rotacion(pcap_file)
+                        if sequence and sequence > last_sequence + 1:
+                            logger.warning(f"dumpcap discarded {sequence - last_sequence - 1} rotated "
+                                           f"PCAP files before they were converted")
+                        last_sequence = max(last_sequence, sequence or 0)
+                        queued.add(pcap_file)
+                        pcap_queue.put(pcap_file)
+                if finished:
+                    break
+                time.sleep(1)
+        finally:
+            if process.poll() is None:
+                process.terminate()
+                process.wait()
+            pcap_queue.put(None)
+            for worker in workers:
+                worker.join()
+        
+        success = process.returncode == 0
+        captura.actualizar_estado_session('COMPLETED' if success else 'FAILED',
+                                          completed_at=timezone.now())
+        logger.info(f"Streaming pipeline finished: {len(queued)} PCAP files processed")
+        return success
+    
+    def _worker_conversion(self, pcap_queue, csv_queue):
+        """Convert rotated PCAP files to CSV as soon as they are closed"""
+        compressions = []
+        try:
+            while True:
+                pcap_file = pcap_queue.get()
+                if pcap_file is None:
+                    break
+                result = self.ejecutar_node('--input', pcap_file)
+                if result.returncode == 0:
+                    csv_queue.put(f"{Path(pcap_file).stem}.csv")
+                    # The raw capture is not read again once converted
+                    compression = self.comprimir_pcap(pcap_file)
+                    if compression:
+                        compressions.append(compression)
+                else:
+                    logger.error(f"Conversion failed for {pcap_file}: {result.stderr.strip()}")
+        finally:
+            csv_queue.put(None)
+            for compression in compressions:
+                compression.wait()
+    
+    def _worker_procesamiento(self, csv_queue, prediction_queue):
+        """Load converted CSV files into the database"""
+        try:
+            from scripts.procesar_csv import ProcesadorCSV
+            
+            procesador = ProcesadorCSV(csv_dir=CSV_OUTPUT_DIR)
+            while True:
+                csv_file = csv_queue.get()
+                if csv_file is None:
+                    break
+                if procesador.procesar_archivo_csv(csv_file) > 0:
+                    prediction_queue.put(csv_file)
+        except Exception as e:
+            logger.error(f"Error in streaming processing worker: {e}")
+        finally:
+            prediction_queue.put(None)
+    
+    def _worker_prediccion(self, prediction_queue):
+        """Run predictions over newly inserted records"""
+        try:
+            from scripts.predecir_csv import PredictorAnomalias
+            
+            predictor = PredictorAnomalias()
+            while True:
+                csv_file = prediction_queue.get()
+                if csv_file is None:
+                    break
+                registros = predictor.predecir_anomalias()
+                logger.info(f"Predictions for {csv_file}: {registros} records processed")
+        except Exception as e:
+            logger.error(f"Error in streaming prediction worker: {e}")
+    
     def ejecutar_pipeline_continuo(self, interval_minutes=30):
         """Execute pipeline continuously at specified intervals"""
         logger.info(f"Starting continuous pipeline (every {interval_minutes} minutes)")
@@ -258,8 +441,8 @@ class PipelineAutomatizado:
 def main():
     """Main function with command line interface"""
     parser = argparse.ArgumentParser(description="Automated anomaly detection pipeline")
-    parser.add_argument('--mode', choices=['once', 'continuous'], default='once',
-                      help='Run pipeline once or continuously')
+    parser.add_argument('--mode', choices=['once', 'continuous', 'streaming'], default='once',
+                      help='Run pipeline once, continuously, or streaming over rotated captures')
     parser.add_argument('--interval', type=int, default=30,
                       help='Interval in minutes for continuous mode (default: 30)')
     parser.add_argument('--interface', default='eth0',
@@ -287,6 +470,9 @@ def main():
         if args.mode == 'once':
             success = pipeline.ejecutar_pipeline_completo()
             sys.exit(0 if success else 1)
+        elif args.mode == 'streaming':
+            success = pipeline.ejecutar_pipeline_streaming()
+            sys.exit(0 if success else 1)
         else:
             pipeline.ejecutar_pipeline_continuo(args.interval)
     except KeyboardInterrupt:
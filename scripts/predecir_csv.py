@@ -17,6 +17,7 @@ import logging
 from pathlib import Path
 from datetime import datetime
 import argparse
+import itertools
 
 # Añadir el directorio raíz al path para importar Django
 sys.path.append(str(Path(__file__).parent.parent))
@@ -26,6 +27,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'anomalia_detection.settings.dev
 
 try:
     django.setup()
+    from django.db import connection, transaction
     from apps.traffic.models import TraficoRed
     from apps.prediction.models import ModeloPrediccion
     from apps.core.models import SystemConfiguration
@@ -47,6 +49,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Filas mínimas por hilo al puntuar; por debajo no compensa repartir
+FILAS_POR_HILO = 10000
+
+# Filas leídas y puntuadas por bloque en predecir_anomalias
+FILAS_POR_BLOQUE = 50000
+
+# Versión registrada en cada ModeloPrediccion
+MODELO_VERSION = 'isolation_forest_v1'
+
+# Etiqueta por índice: 0 normal, 1 anomalía (-1 en IsolationForest)
+ETIQUETAS = np.array(['NORMAL', 'ANOMALO'], dtype=object)
+
 
 class PredictorAnomalias:
     """Sistema de predicción de anomalías de tráfico de red"""
@@ -55,6 +69,8 @@ class PredictorAnomalias:
         self.model_dir = model_dir or '/media/models/'
         self.model = None
         self.scaler = None
+        self.media = None
+        self.escala_inv = None
         
         # Características utilizadas para predicción
         self.features = [
@@ -64,6 +80,16 @@ class PredictorAnomalias:
             'fwd_packet_length_mean', 'fwd_packet_length_std'
         ]
         
+        # Tipo de fila para leer id + características sin instanciar modelos
+        self.dtype_filas = np.dtype(
+            [('id', np.int64)] + [(f, np.float32) for f in self.features]
+        )
+        
+        # Rangos válidos de las columnas acotadas, que son las primeras de
+        # self.features (src_port, dst_port, packet_size, duration)
+        self.limite_min = np.array([0, 0, 0, 0], dtype=np.float32)
+        self.limite_max = np.array([65535, 65535, 65535, 3600], dtype=np.float32)
+        
         # Crear directorio de modelos
         os.makedirs(self.model_dir, exist_ok=True)
         
@@ -72,13 +98,23 @@ class PredictorAnomalias:
     
     def cargar_modelo(self):
         """Carga modelo pre-entrenado o crea uno nuevo"""
+        bundle_path = os.path.join(self.model_dir, 'anomaly_model.joblib')
         model_path = os.path.join(self.model_dir, 'anomaly_model.pkl')
         scaler_path = os.path.join(self.model_dir, 'scaler.pkl')
         
         try:
-            if os.path.exists(model_path) and os.path.exists(scaler_path):
-                self.model = joblib.load(model_path)
-                self.scaler = joblib.load(scaler_path)
+            if os.path.exists(bundle_path):
+                estado = joblib.load(bundle_path, mmap_mode='r')
+                self.model = estado['model']
+                self.scaler = estado['scaler']
+                self.preparar_scaler()
+                logger.info("Modelo cargado exitosamente")
+                return True
+            elif os.path.exists(model_path) and os.path.exists(scaler_path):
+                # Formato anterior: modelo y scaler en archivos separados
+                self.model = joblib.load(model_path, mmap_mode='r')
+                self.scaler = joblib.load(scaler_path, mmap_mode='r')
+                self.preparar_scaler()
                 logger.info("Modelo cargado exitosamente")
                 return True
             else:
@@ -97,13 +133,13 @@ class PredictorAnomalias:
                 # Obtener datos de entrenamiento
                 registros = TraficoRed.objects.all()[:10000]  # Primeros 10k registros
                 
-                if len(registros) < 100:
+                if registros.count() < 100:
                     logger.warning("Pocos datos disponibles, creando modelo sintético")
                     return self.crear_modelo_sintetico()
                 
-                # Convertir a DataFrame
-                df = self.convertir_a_dataframe(registros)
-                return self.entrenar_modelo(df)
+                # Leer características directamente a una matriz, sin pandas
+                X = self.matriz_de_filas(self.leer_filas(registros))
+                return self.entrenar_matriz(X)
             else:
                 return self.crear_modelo_sintetico()
                 
@@ -116,80 +152,84 @@ class PredictorAnomalias:
         logger.info("Creando modelo con datos sintéticos...")
         
         try:
-            # Generar datos sintéticos
-            np.random.seed(42)
+            # Generar datos sintéticos directamente en una matriz, columnas en
+            # el orden de self.features (ya dentro de los rangos de preprocesar_datos)
+            rng = np.random.default_rng(42)
             n_samples = 1000
             
-            data = {
-                'src_port': np.random.randint(1024, 65535, n_samples),
-                'dst_port': np.random.randint(1, 65535, n_samples),
-                'packet_size': np.random.exponential(1000, n_samples),
-                'duration': np.random.exponential(1.0, n_samples),
-                'flow_bytes_per_sec': np.random.exponential(10000, n_samples),
-                'flow_packets_per_sec': np.random.exponential(100, n_samples),
-                'total_fwd_packets': np.random.poisson(10, n_samples),
-                'total_backward_packets': np.random.poisson(5, n_samples),
-                'fwd_packet_length_mean': np.random.normal(800, 200, n_samples),
-                'fwd_packet_length_std': np.random.exponential(100, n_samples)
-            }
-            
-            df = pd.DataFrame(data)
+            X = np.empty((n_samples, len(self.features)), dtype=np.float32)
+            X[:, 0] = rng.integers(1024, 65535, n_samples)  # src_port
+            X[:, 1] = rng.integers(1, 65535, n_samples)  # dst_port
+            X[:, 2] = rng.exponential(1000, n_samples)  # packet_size
+            X[:, 3] = rng.exponential(1.0, n_samples)  # duration
+            X[:, 4] = rng.exponential(10000, n_samples)  # flow_bytes_per_sec
+            X[:, 5] = rng.exponential(100, n_samples)  # flow_packets_per_sec
+            X[:, 6] = rng.poisson(10, n_samples)  # total_fwd_packets
+            X[:, 7] = rng.poisson(5, n_samples)  # total_backward_packets
+            X[:, 8] = rng.normal(800, 200, n_samples)  # fwd_packet_length_mean
+            X[:, 9] = rng.exponential(100, n_samples)  # fwd_packet_length_std
             
             # Entrenar modelo
-            return self.entrenar_modelo(df)
+            return self.entrenar_matriz(X)
             
         except Exception as e:
             logger.error(f"Error creando modelo sintético: {e}")
             return False
     
-    def convertir_a_dataframe(self, registros):
-        """Convierte registros Django a DataFrame"""
-        data = []
-        for registro in registros:
-            data.append({
-                'id': registro.id,
-                'src_port': registro.src_port,
-                'dst_port': registro.dst_port,
-                'packet_size': registro.packet_size,
-                'duration': registro.duration,
-                'flow_bytes_per_sec': registro.flow_bytes_per_sec,
-                'flow_packets_per_sec': registro.flow_packets_per_sec,
-                'total_fwd_packets': registro.total_fwd_packets,
-                'total_backward_packets': registro.total_backward_packets,
-                'fwd_packet_length_mean': registro.fwd_packet_length_mean,
-                'fwd_packet_length_std': registro.fwd_packet_length_std
-            })
-        
-        return pd.DataFrame(data)
+    def leer_filas(self, registros):
+        """Lee id y características de un queryset sin instanciar modelos"""
+        return np.fromiter(
+            registros.values_list('id', *self.features),
+            dtype=self.dtype_filas
+        )
+    
+    def matriz_de_filas(self, filas):
+        """Vista float32 (filas, características) limpia sobre un bloque de filas"""
+        # Las características son float32 contiguas tras el id: una vista con
+        # el paso de fila del tipo estructurado, sin copiar el bloque
+        X = np.ndarray(
+            shape=(len(filas), len(self.features)),
+            dtype=np.float32,
+            buffer=filas,
+            offset=self.dtype_filas.fields[self.features[0]][1],
+            strides=(filas.itemsize, np.dtype(np.float32).itemsize)
+        )
+        return self.limpiar_matriz(X)
     
     def preprocesar_datos(self, df):
         """Preprocesa datos para entrenamiento/predicción"""
-        # Seleccionar características
-        X = df[self.features].copy()
-        
-        # Manejar valores faltantes
-        X = X.fillna(0)
-        
-        # Manejar valores infinitos
-        X = X.replace([np.inf, -np.inf], 0)
+        # Seleccionar características en una sola matriz numpy
+        X = df[self.features].to_numpy(dtype=np.float32, copy=True)
+        return self.limpiar_matriz(X)
+    
+    def limpiar_matriz(self, X):
+        """Limpia en su sitio una matriz float32 de características"""
+        # Manejar valores faltantes e infinitos
+        np.nan_to_num(X, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
         
         # Validar rangos
-        X['src_port'] = X['src_port'].clip(0, 65535)
-        X['dst_port'] = X['dst_port'].clip(0, 65535)
-        X['packet_size'] = X['packet_size'].clip(0, 65535)
-        X['duration'] = X['duration'].clip(0, 3600)
+        acotadas = X[:, :len(self.limite_min)]
+        np.clip(acotadas, self.limite_min, self.limite_max, out=acotadas)
         
         return X
     
-    def entrenar_modelo(self, df):
-        """Entrena el modelo de detección de anomalías"""
+    def preparar_scaler(self):
+        """Guarda media y escala inversa del scaler como arrays float32"""
+        self.media = self.scaler.mean_.astype(np.float32)
+        self.escala_inv = (1.0 / self.scaler.scale_).astype(np.float32)
+    
+    def escalar(self, X):
+        """Normaliza en su sitio una matriz float32 de preprocesar_datos"""
+        np.subtract(X, self.media, out=X)
+        np.multiply(X, self.escala_inv, out=X)
+        return X
+    
+    def entrenar_matriz(self, X):
+        """Entrena el modelo sobre una matriz de características ya preprocesada"""
         try:
-            logger.info(f"Entrenando modelo con {len(df)} registros...")
+            logger.info(f"Entrenando modelo con {len(X)} registros...")
             
-            # Preprocesar datos
-            X = self.preprocesar_datos(df)
-            
-            if X.empty:
+            if len(X) == 0:
                 raise Exception("No hay datos válidos para entrenamiento")
             
             # Configurar parámetros del modelo
@@ -201,16 +241,18 @@ class PredictorAnomalias:
                 except:
                     pass
             
-            # Normalizar datos
+            # Normalizar datos (float32, el tipo con el que IsolationForest
+            # recorre los árboles; así no se copia la matriz al puntuar)
             self.scaler = StandardScaler()
-            X_scaled = self.scaler.fit_transform(X)
+            X_scaled = self.scaler.fit_transform(np.asarray(X, dtype=np.float32))
+            self.preparar_scaler()
             
             # Entrenar modelo
             self.model = IsolationForest(
                 contamination=contamination,
                 random_state=42,
-                n_estimators=100,
-                max_samples='auto',
+                n_estimators=50,
+                max_samples=256,
                 bootstrap=False,
                 n_jobs=-1
             )
@@ -221,8 +263,8 @@ class PredictorAnomalias:
             self.guardar_modelo()
             
             # Evaluar modelo
-            scores = self.model.decision_function(X_scaled)
-            predictions = self.model.predict(X_scaled)
+            scores = self.puntuar(X_scaled)
+            predictions = np.where(scores < 0, -1, 1).astype(np.int8)
             
             anomalias = np.sum(predictions == -1)
             normales = np.sum(predictions == 1)
@@ -254,6 +296,20 @@ class PredictorAnomalias:
             logger.error(f"Error entrenando modelo: {e}")
             return False
     
+    def puntuar(self, X_scaled):
+        """Calcula decision_function repartiendo bloques de filas entre hilos"""
+        n_hilos = min(os.cpu_count() or 1, len(X_scaled) // FILAS_POR_HILO)
+        if n_hilos <= 1:
+            return self.model.decision_function(X_scaled)
+        
+        # El recorrido de los árboles libera el GIL, así que los hilos
+        # escalan sin copiar la matriz a otros procesos
+        bloques = np.array_split(X_scaled, n_hilos)
+        partes = joblib.Parallel(n_jobs=n_hilos, backend='threading')(
+            joblib.delayed(self.model.decision_function)(bloque) for bloque in bloques
+        )
+        return np.concatenate(partes)
+    
     def predecir_anomalias(self, registros_ids=None, batch_size=1000):
         """Predice anomalías en registros no procesados"""
         if not self.model or not self.scaler:
@@ -271,100 +327,83 @@ class PredictorAnomalias:
             if registros_ids:
                 query = query.filter(id__in=registros_ids)
             
-            registros = list(query)
-            
-            if not registros:
-                logger.info("No hay registros para procesar")
-                return 0
-            
-            logger.info(f"Procesando {len(registros)} registros...")
-            
-            # Convertir a DataFrame
-            df = self.convertir_a_dataframe(registros)
-            
-            # Preprocesar datos
-            X = self.preprocesar_datos(df)
+            # Leer por bloques con un cursor en servidor: en memoria solo
+            # hay un bloque de filas, no toda la tabla pendiente
+            filas = query.values_list('id', *self.features).iterator(chunk_size=batch_size)
+            filas_por_bloque = max(batch_size, FILAS_POR_BLOQUE)
             
-            if X.empty:
-                logger.warning("No hay datos válidos para predicción")
-                return 0
-            
-            # Normalizar datos
-            X_scaled = self.scaler.transform(X)
-            
-            # Realizar predicciones
-            predictions = self.model.predict(X_scaled)
-            scores = self.model.decision_function(X_scaled)
-            
-            # Procesar en lotes para evitar problemas de memoria
             registros_actualizados = 0
             predicciones_creadas = 0
-            
-            for i in range(0, len(registros), batch_size):
-                batch_registros = registros[i:i+batch_size]
-                batch_predictions = predictions[i:i+batch_size]
-                batch_scores = scores[i:i+batch_size]
+            total = 0
+            anomalias = 0
+            lotes = 0
+            
+            while True:
+                bloque = np.fromiter(
+                    itertools.islice(filas, filas_por_bloque),
+                    dtype=self.dtype_filas
+                )
+                if len(bloque) == 0:
+                    break
                 
-                # Actualizar registros en lote
-                batch_updates = []
-                batch_predicciones = []
+                logger.info(f"Procesando {len(bloque)} registros...")
+                ids = bloque['id'].tolist()
                 
-                for j, registro in enumerate(batch_registros):
-                    # -1 es anomalía, 1 es normal en IsolationForest
-                    es_anomalia = batch_predictions[j] == -1
-                    score = batch_scores[j]
-                    confidence = abs(score)  # Convertir a valor positivo
-                    
-                    # Actualizar registro
-                    registro.label = 'ANOMALO' if es_anomalia else 'NORMAL'
-                    registro.confidence_score = confidence
-                    registro.procesado = True
-                    batch_updates.append(registro)
-                    
-                    # Crear predicción
-                    batch_predicciones.append(ModeloPrediccion(
-                        trafico=registro,
-                        prediccion=registro.label,
-                        confidence_score=confidence,
-                        modelo_version='isolation_forest_v1',
-                        fecha_prediccion=datetime.now()
-                    ))
+                # Vista float32 (filas, características) sobre el mismo bloque:
+                # limpieza y normalización se hacen en ese único buffer
+                X = self.matriz_de_filas(bloque)
                 
-                # Actualizar en lote
-                TraficoRed.objects.bulk_update(
-                    batch_updates, 
-                    ['label', 'confidence_score', 'procesado']
-                )
+                # Normalizar datos en float32, igual que en el entrenamiento
+                X_scaled = self.escalar(X)
                 
-                # Crear predicciones en lote
-                ModeloPrediccion.objects.bulk_create(batch_predicciones)
+                # Realizar predicciones: un solo recorrido de los árboles,
+                # predict() equivale a decision_function() < 0
+                scores = self.puntuar(X_scaled)
+                es_anomalia = scores < 0
+                etiquetas = ETIQUETAS[es_anomalia.view(np.int8)]
+                confidencias = np.abs(scores).tolist()  # Convertir a valor positivo
                 
-                registros_actualizados += len(batch_updates)
-                predicciones_creadas += len(batch_predicciones)
+                total += len(ids)
+                anomalias += int(np.count_nonzero(es_anomalia))
                 
-                logger.debug(f"Lote {i//batch_size + 1}: {len(batch_updates)} registros procesados")
+                # Guardar en lotes
+                for i in range(0, len(ids), batch_size):
+                    batch_ids = ids[i:i+batch_size]
+                    batch_etiquetas = etiquetas[i:i+batch_size]
+                    batch_confidencias = confidencias[i:i+batch_size]
+                    
+                    guardados = self.guardar_lote(batch_ids, batch_etiquetas, batch_confidencias)
+                    
+                    registros_actualizados += guardados
+                    predicciones_creadas += guardados
+                    lotes += 1
+                    
+                    logger.debug(f"Lote {lotes}: {guardados} registros procesados")
+            
+            if total == 0:
+                logger.info("No hay registros para procesar")
+                return 0
             
             # Estadísticas finales
-            anomalias = np.sum(predictions == -1)
-            normales = np.sum(predictions == 1)
+            normales = total - anomalias
             
             logger.info(f"Predicción completada:")
             logger.info(f"- Registros procesados: {registros_actualizados}")
-            logger.info(f"- Anomalías detectadas: {anomalias} ({anomalias/len(predictions)*100:.1f}%)")
-            logger.info(f"- Normales: {normales} ({normales/len(predictions)*100:.1f}%)")
+            logger.info(f"- Anomalías detectadas: {anomalias} ({anomalias/total*100:.1f}%)")
+            logger.info(f"- Normales: {normales} ({normales/total*100:.1f}%)")
             logger.info(f"- Predicciones creadas: {predicciones_creadas}")
             
             # Crear alerta si hay muchas anomalías
-            if anomalias > len(predictions) * 0.2:  # Más del 20%
+            if anomalias > total * 0.2:  # Más del 20%
                 create_system_alert(
                     title='Alto número de anomalías detectadas',
-                    description=f'Se detectaron {anomalias} anomalías de {len(predictions)} registros procesados ({anomalias/len(predictions)*100:.1f}%)',
+                    description=f'Se detectaron {anomalias} anomalías de {total} registros procesados ({anomalias/total*100:.1f}%)',
                     severity='medium',
                     alert_type='high_anomalies',
                     alert_data={
-                        'total_processed': len(predictions),
+                        'total_processed': total,
                         'anomalies_detected': int(anomalias),
-                        'anomaly_percentage': float(anomalias/len(predictions)*100)
+                        'anomaly_percentage': float(anomalias/total*100)
                     }
                 )
             
@@ -374,16 +413,87 @@ class PredictorAnomalias:
             logger.error(f"Error en predicción: {e}")
             return 0
     
+    def guardar_lote(self, ids, etiquetas, confidencias):
+        """Marca un lote como procesado y registra sus predicciones"""
+        if connection.vendor != 'postgresql':
+            batch_updates = []
+            batch_predicciones = []
+            # Una sola marca de tiempo para todo el lote, como NOW() en PostgreSQL
+            fecha_prediccion = datetime.now()
+            
+            for registro_id, label, confidence in zip(ids, etiquetas, confidencias):
+                # Actualizar registro (solo la pk y los campos a escribir)
+                batch_updates.append(TraficoRed(
+                    id=registro_id,
+                    label=label,
+                    confidence_score=confidence,
+                    procesado=True
+                ))
+                
+                # Crear predicción
+                batch_predicciones.append(ModeloPrediccion(
+                    trafico_id=registro_id,
+                    prediccion=label,
+                    confidence_score=confidence,
+                    modelo_version=MODELO_VERSION,
+                    fecha_prediccion=fecha_prediccion
+                ))
+            
+            # Etiquetas y predicciones del lote se guardan juntas
+            with transaction.atomic():
+                TraficoRed.objects.bulk_update(
+                    batch_updates, 
+                    ['label', 'confidence_score', 'procesado']
+                )
+                ModeloPrediccion.objects.bulk_create(batch_predicciones)
+            
+            return len(batch_predicciones)
+        
+        # PostgreSQL: UPDATE e INSERT en una sola sentencia (CTE con
+        # modificación de datos), un único viaje al servidor por lote
+        from psycopg2.extras import execute_values
+        
+        trafico = connection.ops.quote_name(TraficoRed._meta.db_table)
+        predicciones = connection.ops.quote_name(ModeloPrediccion._meta.db_table)
+        sql = f"""
+            WITH v (id, label, confidence_score, modelo_version) AS (VALUES %s),
+            actualizados AS (
+                UPDATE {trafico} AS t
+                SET label = v.label, confidence_score = v.confidence_score, procesado = TRUE
+                FROM v
+                WHERE t.id = v.id
+                RETURNING t.id
+            )
+            INSERT INTO {predicciones}
+                (trafico_id, prediccion, confidence_score, modelo_version, fecha_prediccion)
+            SELECT v.id, v.label, v.confidence_score, v.modelo_version, NOW()
+            FROM v JOIN actualizados USING (id)
+        """
+        filas = [
+            (registro_id, label, confidence, MODELO_VERSION)
+            for registro_id, label, confidence in zip(ids, etiquetas, confidencias)
+        ]
+        
+        with connection.cursor() as cursor:
+            execute_values(
+                cursor, sql, filas,
+                template='(%s::bigint, %s::varchar, %s::double precision, %s::varchar)',
+                page_size=len(filas)
+            )
+            return cursor.rowcount
+    
     def guardar_modelo(self):
         """Guarda modelo y scaler entrenados"""
         try:
-            model_path = os.path.join(self.model_dir, 'anomaly_model.pkl')
-            scaler_path = os.path.join(self.model_dir, 'scaler.pkl')
+            bundle_path = os.path.join(self.model_dir, 'anomaly_model.joblib')
             metadata_path = os.path.join(self.model_dir, 'model_metadata.json')
             
-            # Guardar modelo y scaler
-            joblib.dump(self.model, model_path)
-            joblib.dump(self.scaler, scaler_path)
+            # Guardar modelo y scaler juntos (sin comprimir para poder
+            # cargarlos con mmap). Se escribe a un temporal y se renombra:
+            # truncar un archivo mapeado por otro proceso lo rompería
+            tmp_path = f"{bundle_path}.tmp"
+            joblib.dump({'model': self.model, 'scaler': self.scaler}, tmp_path)
+            os.replace(tmp_path, bundle_path)
             
             # Guardar metadatos
             import json
@@ -462,7 +572,7 @@ class PredictorAnomalias:
             
             # Hacer predicción de prueba
             X = self.preprocesar_datos(test_data)
-            X_scaled = self.scaler.transform(X)
+            X_scaled = self.escalar(X)
             predictions = self.model.predict(X_scaled)
             
             logger.info("Modelo validado exitosamente")
@@ -9,6 +9,14 @@ import numpy as np
 import os
 import sys
 import logging
+import re
+import ipaddress
+import codecs
+import itertools
+import shutil
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
 import django
@@ -22,6 +30,8 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'anomalia_detection.settings.dev
 
 try:
     django.setup()
+    from django.db import connection, connections, transaction
+    from django.utils import timezone
     from apps.traffic.models import TraficoRed
     from apps.core.models import SystemConfiguration
     from apps.core.utils import create_system_alert
@@ -41,15 +51,50 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# IPv4 en forma canónica (sin ceros a la izquierda), igual que str(ip_address)
+IPV4_RE = re.compile(r'(?:(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)\.){3}(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)')
+
+# Protocolo normalizado y patrón que lo identifica, en orden de prioridad
+PROTOCOLOS = [
+    ('TCP', 'TCP'),
+    ('UDP', 'UDP'),
+    ('ICMP', 'ICMP'),
+    ('HTTP', r'(?s)^(?!.*HTTPS).*HTTP'),
+    ('HTTPS', 'HTTPS|SSL|TLS'),
+    ('DNS', 'DNS'),
+    ('SSH', 'SSH'),
+    ('FTP', 'FTP'),
+    ('SMTP', 'SMTP'),
+]
+
+# Columnas estándar que se leen como texto
+COLUMNAS_TEXTO = {'src_ip', 'dst_ip', 'protocol', 'tcp_flags'}
+
+
+def normalizar_ip(valor):
+    """Normaliza una IP (v4 o v6); devuelve 0.0.0.0 si no es válida"""
+    try:
+        return str(ipaddress.ip_address(valor))
+    except ValueError:
+        return '0.0.0.0'
+
+
+def _procesar_en_proceso(csv_dir, csv_file, batch_size):
+    """Procesa un archivo CSV en un proceso hijo del pool"""
+    return ProcesadorCSV(csv_dir=csv_dir, batch_size=batch_size).procesar_archivo_csv(csv_file)
+
 
 class ProcesadorCSV:
     """Clase para procesar y limpiar archivos CSV de tráfico de red"""
     
-    def __init__(self, csv_dir=None, batch_size=1000):
+    def __init__(self, csv_dir=None, batch_size=None):
         self.csv_dir = csv_dir or '/media/csv_files/'
         self.processed_dir = os.path.join(self.csv_dir, 'processed')
         self.error_dir = os.path.join(self.csv_dir, 'errors')
-        self.batch_size = batch_size
+        # Tamaño de lote ajustable por entorno según el motor de BD
+        self.batch_size = batch_size or int(os.environ.get('CSV_BULK_CREATE_BATCH_SIZE', '1000'))
+        self.db_batch_size = int(os.environ.get('DB_INSERT_BATCH_SIZE', str(self.batch_size)))
+        self.filas_lectura = 50000
         
         # Mapeo de columnas estándar
         self.columns_mapping = {
@@ -66,6 +111,8 @@ class ProcesadorCSV:
             'tcp_flags': 'tcp_flags',
             'protocols': 'protocol'
         }
+        # Mapeos ya calculados, por cabecera de CSV
+        self.mapeos_cabecera = {}
         
         # Crear directorios necesarios
         self.crear_directorios()
@@ -78,105 +125,169 @@ class ProcesadorCSV:
     def listar_archivos_csv(self):
         """Lista archivos CSV pendientes de procesar"""
         try:
-            archivos = [
-                f for f in os.listdir(self.csv_dir) 
-                if f.endswith('.csv') and os.path.isfile(os.path.join(self.csv_dir, f))
-            ]
+            # scandir trae el tipo de archivo con la entrada, sin un stat por archivo
+            with os.scandir(self.csv_dir) as entradas:
+                archivos = [
+                    e.name for e in entradas
+                    if e.name.endswith('.csv') and e.is_file()
+                ]
             return sorted(archivos)
         except Exception as e:
             logger.error(f"Error listando archivos CSV: {e}")
             return []
     
-    def leer_csv(self, csv_file):
-        """Lee archivo CSV con manejo de errores"""
+    def detectar_encoding(self, csv_file):
+        """Detecta el encoding por BOM y por los bytes de los primeros 64 KB"""
+        with open(csv_file, 'rb') as f:
+            muestra = f.read(65536)
+        
+        if muestra.startswith(codecs.BOM_UTF8):
+            return 'utf-8-sig'
+        
         try:
-            logger.info(f"Leyendo archivo: {csv_file}")
-            
-            # Intentar leer con diferentes encodings
-            encodings = ['utf-8', 'latin1', 'cp1252']
-            df = None
-            
-            for encoding in encodings:
-                try:
-                    df = pd.read_csv(csv_file, encoding=encoding, low_memory=False)
-                    logger.debug(f"Archivo leído con encoding: {encoding}")
-                    break
-                except UnicodeDecodeError:
-                    continue
-            
-            if df is None:
-                raise Exception("No se pudo leer el archivo con ningún encoding")
-            
-            logger.info(f"CSV leído: {len(df)} filas, {len(df.columns)} columnas")
-            return df
-            
-        except Exception as e:
-            logger.error(f"Error leyendo CSV {csv_file}: {e}")
-            raise
+            # Decodificador incremental: un carácter cortado al final de la muestra no es error
+            codecs.getincrementaldecoder('utf-8')().decode(muestra, final=False)
+            return 'utf-8'
+        except UnicodeDecodeError:
+            pass
+        
+        # Bytes 0x80-0x9F son controles en latin1 pero comillas, guiones, etc. en cp1252
+        # (exportaciones de Windows); sin ellos ambos coinciden y latin1 nunca falla
+        if re.search(rb'[\x80-\x9f]', muestra):
+            try:
+                muestra.decode('cp1252')
+                return 'cp1252'
+            except UnicodeDecodeError:
+                pass
+        return 'latin1'
+    
+    def iterar_csv(self, csv_file):
+        """Lee el CSV por bloques de filas para no cargar el archivo entero en memoria"""
+        logger.info(f"Leyendo archivo: {csv_file}")
+        
+        encoding = self.detectar_encoding(csv_file)
+        logger.debug("Archivo leído con encoding: %s", encoding)
+        
+        # Comprobación previa con unas pocas filas: decide qué columnas y tipos cargar y
+        # descarta archivos ilegibles o sin columnas conocidas antes de leerlos enteros
+        cabecera = pd.read_csv(csv_file, encoding=encoding, encoding_errors='replace', nrows=5).columns
+        usecols, dtype = self.esquema_csv(cabecera)
+        if not usecols:
+            raise ValueError(f"Ninguna columna reconocida en la cabecera: {list(cabecera)}")
+        
+        # La detección solo ve los primeros 64 KB: un byte inválido más adelante
+        # se sustituye por U+FFFD en lugar de abortar a mitad de archivo con
+        # bloques anteriores ya guardados en BD
+        opciones = dict(
+            encoding=encoding, encoding_errors='replace', usecols=usecols,
+            dtype=dtype, engine='c', chunksize=self.filas_lectura
+        )
+        try:
+            # mmap: el tokenizador lee directamente de la caché de páginas
+            lector = pd.read_csv(csv_file, memory_map=True, **opciones)
+        except (OSError, ValueError):
+            # Sistemas de archivos sin soporte de mmap (p. ej. montajes de red)
+            lector = pd.read_csv(csv_file, **opciones)
+        
+        with lector:
+            for bloque in lector:
+                logger.debug("Bloque leído: %d filas, %d columnas", len(bloque), len(bloque.columns))
+                yield bloque
+    
+    def columna_estandar(self, csv_col):
+        """Nombre estándar de una columna del CSV, o None si no se usa"""
+        csv_col_lower = str(csv_col).lower().strip()
+        
+        # Mapeo directo
+        if csv_col_lower in self.columns_mapping:
+            return self.columns_mapping[csv_col_lower]
+        # Mapeo por similitud
+        elif 'src' in csv_col_lower and 'ip' in csv_col_lower:
+            return 'src_ip'
+        elif 'dst' in csv_col_lower and 'ip' in csv_col_lower:
+            return 'dst_ip'
+        elif 'src' in csv_col_lower and 'port' in csv_col_lower:
+            return 'src_port'
+        elif 'dst' in csv_col_lower and 'port' in csv_col_lower:
+            return 'dst_port'
+        elif 'protocol' in csv_col_lower:
+            return 'protocol'
+        elif 'size' in csv_col_lower or 'len' in csv_col_lower:
+            return 'packet_size'
+        elif 'time' in csv_col_lower or 'duration' in csv_col_lower:
+            return 'duration'
+        return None
+    
+    def esquema_csv(self, columnas):
+        """Columnas a cargar y tipos fijos para las de texto"""
+        usecols = []
+        dtype = {}
+        for col in columnas:
+            estandar = self.columna_estandar(col)
+            if estandar is None:
+                continue
+            usecols.append(col)
+            # Texto sin inferencia; las numéricas las limpia limpiar_datos
+            if estandar in COLUMNAS_TEXTO:
+                dtype[col] = str
+        return usecols, dtype
     
     def mapear_columnas(self, df):
         """Mapea columnas del CSV a nombres estándar"""
         logger.debug("Mapeando columnas...")
         
-        # Mostrar columnas disponibles
-        logger.debug(f"Columnas disponibles: {list(df.columns)}")
-        
-        # Crear mapeo dinámico basado en las columnas disponibles
-        column_map = {}
-        for csv_col in df.columns:
-            csv_col_lower = csv_col.lower().strip()
-            
-            # Mapeo directo
-            if csv_col_lower in self.columns_mapping:
-                column_map[csv_col] = self.columns_mapping[csv_col_lower]
-            # Mapeo por similitud
-            elif 'src' in csv_col_lower and 'ip' in csv_col_lower:
-                column_map[csv_col] = 'src_ip'
-            elif 'dst' in csv_col_lower and 'ip' in csv_col_lower:
-                column_map[csv_col] = 'dst_ip'
-            elif 'src' in csv_col_lower and 'port' in csv_col_lower:
-                column_map[csv_col] = 'src_port'
-            elif 'dst' in csv_col_lower and 'port' in csv_col_lower:
-                column_map[csv_col] = 'dst_port'
-            elif 'protocol' in csv_col_lower:
-                column_map[csv_col] = 'protocol'
-            elif 'size' in csv_col_lower or 'len' in csv_col_lower:
-                column_map[csv_col] = 'packet_size'
-            elif 'time' in csv_col_lower or 'duration' in csv_col_lower:
-                column_map[csv_col] = 'duration'
+        # Mostrar columnas disponibles (solo construir la lista si se va a registrar)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Columnas disponibles: %s", list(df.columns))
+        
+        # Crear mapeo dinámico basado en las columnas disponibles; los bloques de un
+        # mismo archivo (y los archivos de un mismo origen) comparten cabecera
+        cabecera = tuple(df.columns)
+        column_map = self.mapeos_cabecera.get(cabecera)
+        if column_map is None:
+            column_map = {}
+            for csv_col in cabecera:
+                estandar = self.columna_estandar(csv_col)
+                if estandar:
+                    column_map[csv_col] = estandar
+            self.mapeos_cabecera[cabecera] = column_map
         
         # Renombrar columnas
         df_renamed = df.rename(columns=column_map)
-        logger.debug(f"Columnas mapeadas: {column_map}")
+        logger.debug("Columnas mapeadas: %s", column_map)
         
         return df_renamed
     
     def limpiar_datos(self, df):
-        """Limpia y normaliza los datos"""
+        """Limpia y normaliza los datos en una sola pasada por columnas"""
         logger.info("Iniciando limpieza de datos...")
         filas_originales = len(df)
         
-        # 1. Eliminar filas completamente vacías
-        df = df.dropna(how='all')
-        logger.debug(f"Filas después de eliminar vacías: {len(df)}")
+        # Cada paso devuelve columnas limpias; el DataFrame de salida se construye
+        # una sola vez y se filtra con una única máscara al final
+        columnas = {}
+        
+        # 1. Validar y limpiar IPs
+        columnas.update(self.limpiar_ips(df))
         
-        # 2. Validar y limpiar IPs
-        df = self.limpiar_ips(df)
+        # 2. Validar y limpiar puertos
+        columnas.update(self.limpiar_puertos(df))
         
-        # 3. Validar y limpiar puertos
-        df = self.limpiar_puertos(df)
+        # 3. Limpiar protocolo
+        columnas['protocol'] = self.limpiar_protocolo(df, columnas['dst_port'])
         
-        # 4. Limpiar protocolo
-        df = self.limpiar_protocolo(df)
+        # 4. Limpiar métricas numéricas
+        columnas.update(self.limpiar_metricas(df))
         
-        # 5. Limpiar métricas numéricas
-        df = self.limpiar_metricas(df)
+        # 5. Calcular campos derivados
+        columnas.update(self.calcular_campos_derivados(columnas['packet_size'], columnas['duration']))
         
-        # 6. Calcular campos derivados
-        df = self.calcular_campos_derivados(df)
+        if 'tcp_flags' in df.columns:
+            columnas['tcp_flags'] = df['tcp_flags'].to_numpy()
         
-        # 7. Validación final
-        df = self.validacion_final(df)
+        # 6. Validación final (incluye las filas vacías, que quedan sin IPs válidas)
+        df = pd.DataFrame(columnas, index=df.index)
+        df = df[self.validacion_final(columnas)]
         
         filas_finales = len(df)
         logger.info(f"Limpieza completada: {filas_originales} -> {filas_finales} filas ({filas_finales/filas_originales*100:.1f}% conservadas)")
@@ -187,199 +298,157 @@ class ProcesadorCSV:
         """Limpia y valida direcciones IP"""
         logger.debug("Limpiando direcciones IP...")
         
-        # Función para validar IP
-        def validate_ip(ip_str):
-            if pd.isna(ip_str) or ip_str == '':
-                return '0.0.0.0'
-            
-            try:
-                import ipaddress
-                ip = ipaddress.ip_address(str(ip_str).strip())
-                return str(ip)
-            except:
-                return '0.0.0.0'
-        
-        # Limpiar IPs origen y destino
-        if 'src_ip' in df.columns:
-            df['src_ip'] = df['src_ip'].apply(validate_ip)
-        else:
-            df['src_ip'] = '0.0.0.0'
-            
-        if 'dst_ip' in df.columns:
-            df['dst_ip'] = df['dst_ip'].apply(validate_ip)
-        else:
-            df['dst_ip'] = '0.0.0.0'
+        ips = {}
+        for col in ['src_ip', 'dst_ip']:
+            if col in df.columns:
+                ips[col] = self.validar_ips(df[col]).to_numpy()
+            else:
+                ips[col] = np.full(len(df), '0.0.0.0', dtype=object)
+        
+        return ips
+    
+    def validar_ips(self, serie):
+        """Normaliza una columna de IPs; las inválidas quedan como 0.0.0.0"""
+        s = serie.astype('string').str.strip()
         
-        # Eliminar filas donde ambas IPs son inválidas
-        df = df[~((df['src_ip'] == '0.0.0.0') & (df['dst_ip'] == '0.0.0.0'))]
+        # IPv4 canónicas: validadas con una sola regex vectorizada
+        es_ipv4 = s.str.fullmatch(IPV4_RE).fillna(False).astype(bool)
+        resultado = s.where(es_ipv4)
         
-        return df
+        # Resto (IPv6, formatos raros): ipaddress solo sobre valores únicos
+        otros = ~es_ipv4 & s.notna()
+        if otros.any():
+            normalizadas = {v: normalizar_ip(v) for v in s[otros].unique()}
+            resultado[otros] = s[otros].map(normalizadas)
+        
+        return resultado.fillna('0.0.0.0').astype(object)
     
     def limpiar_puertos(self, df):
         """Limpia y valida puertos"""
         logger.debug("Limpiando puertos...")
         
-        def clean_port(port_val):
-            if pd.isna(port_val) or port_val == '':
-                return 0
+        puertos = {}
+        for col in ['src_port', 'dst_port']:
+            if col in df.columns:
+                puerto = self.validar_puertos(df[col]).to_numpy()
+            else:
+                puerto = np.zeros(len(df), dtype=np.int32)
             
-            try:
-                port = int(float(str(port_val)))
-                return port if 0 <= port <= 65535 else 0
-            except:
-                return 0
-        
-        # Limpiar puertos
-        if 'src_port' in df.columns:
-            df['src_port'] = df['src_port'].apply(clean_port)
-        else:
-            df['src_port'] = 0
+            # Si no hay puerto, intentar obtenerlo de la columna UDP separada
+            col_udp = f'{col}_udp'
+            if col_udp in df.columns:
+                puerto = np.where(puerto == 0, self.validar_puertos(df[col_udp]).to_numpy(), puerto)
             
-        if 'dst_port' in df.columns:
-            df['dst_port'] = df['dst_port'].apply(clean_port)
-        else:
-            df['dst_port'] = 0
-        
-        # Si no hay puertos, intentar obtener de columnas TCP/UDP separadas
-        if 'src_port_udp' in df.columns or 'dst_port_udp' in df.columns:
-            df['src_port'] = df['src_port'].fillna(0) + df.get('src_port_udp', 0).fillna(0)
-            df['dst_port'] = df['dst_port'].fillna(0) + df.get('dst_port_udp', 0).fillna(0)
+            puertos[col] = puerto
         
-        return df
+        return puertos
+    
+    def validar_puertos(self, serie):
+        """Convierte una columna de puertos a int32; inválidos o fuera de rango quedan en 0"""
+        puertos = np.trunc(pd.to_numeric(serie, errors='coerce'))
+        return puertos.where(puertos.between(0, 65535), 0).astype(np.int32)
     
-    def limpiar_protocolo(self, df):
+    def limpiar_protocolo(self, df, dst_port):
         """Limpia campo de protocolo"""
         logger.debug("Limpiando protocolo...")
         
-        def normalize_protocol(protocol_val):
-            if pd.isna(protocol_val) or protocol_val == '':
-                return 'OTHER'
-            
-            protocol_str = str(protocol_val).upper().strip()
-            
-            # Mapeo de protocolos
-            if 'TCP' in protocol_str:
-                return 'TCP'
-            elif 'UDP' in protocol_str:
-                return 'UDP'
-            elif 'ICMP' in protocol_str:
-                return 'ICMP'
-            elif 'HTTP' in protocol_str and 'HTTPS' not in protocol_str:
-                return 'HTTP'
-            elif 'HTTPS' in protocol_str or 'SSL' in protocol_str or 'TLS' in protocol_str:
-                return 'HTTPS'
-            elif 'DNS' in protocol_str:
-                return 'DNS'
-            elif 'SSH' in protocol_str:
-                return 'SSH'
-            elif 'FTP' in protocol_str:
-                return 'FTP'
-            elif 'SMTP' in protocol_str:
-                return 'SMTP'
-            else:
-                return 'OTHER'
-        
         if 'protocol' in df.columns:
-            df['protocol'] = df['protocol'].apply(normalize_protocol)
-        else:
-            # Inferir protocolo basado en puertos
-            df['protocol'] = 'TCP'  # Default
-            
-            # Mapeo básico por puertos
-            df.loc[df['dst_port'].isin([53]), 'protocol'] = 'DNS'
-            df.loc[df['dst_port'].isin([80]), 'protocol'] = 'HTTP'
-            df.loc[df['dst_port'].isin([443]), 'protocol'] = 'HTTPS'
-            df.loc[df['dst_port'].isin([22]), 'protocol'] = 'SSH'
-            df.loc[df['dst_port'].isin([21]), 'protocol'] = 'FTP'
-            df.loc[df['dst_port'].isin([25, 587]), 'protocol'] = 'SMTP'
-        
-        return df
+            return self.normalizar_protocolos(df['protocol'])
+        
+        # Inferir protocolo basado en puertos (TCP por defecto)
+        return np.select(
+            [dst_port == 53, dst_port == 80, dst_port == 443, dst_port == 22,
+             dst_port == 21, np.isin(dst_port, [25, 587])],
+            ['DNS', 'HTTP', 'HTTPS', 'SSH', 'FTP', 'SMTP'],
+            default='TCP'
+        )
+    
+    def normalizar_protocolos(self, serie):
+        """Normaliza una columna de protocolos a los valores de PROTOCOLOS"""
+        s = serie.astype('string').str.upper().fillna('')
+        condiciones = [
+            s.str.contains(patron, regex=True).to_numpy(dtype=bool)
+            for _, patron in PROTOCOLOS
+        ]
+        # np.select toma la primera condición que se cumple, como el if/elif original
+        return np.select(condiciones, [nombre for nombre, _ in PROTOCOLOS], default='OTHER')
     
     def limpiar_metricas(self, df):
         """Limpia métricas numéricas"""
         logger.debug("Limpiando métricas numéricas...")
         
-        def clean_numeric(val, default=0.0):
-            if pd.isna(val) or val == '':
-                return default
-            try:
-                return float(val)
-            except:
-                return default
+        def clean_numeric(col):
+            return pd.to_numeric(df[col], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
         
         # Tamaño de paquete
         if 'packet_size' in df.columns:
-            df['packet_size'] = df['packet_size'].apply(lambda x: clean_numeric(x, 0))
+            packet_size = clean_numeric('packet_size')
         else:
             # Intentar calcular desde otros campos
-            size_cols = ['ip_length', 'tcp_length', 'udp_length']
-            df['packet_size'] = 0
-            for col in size_cols:
+            packet_size = np.zeros(len(df))
+            for col in ['ip_length', 'tcp_length', 'udp_length']:
                 if col in df.columns:
-                    df['packet_size'] += df[col].apply(lambda x: clean_numeric(x, 0))
+                    packet_size += clean_numeric(col)
             
             # Si no hay datos, usar valor por defecto
-            df['packet_size'] = df['packet_size'].apply(lambda x: max(x, 64))  # Mínimo 64 bytes
+            np.maximum(packet_size, 64, out=packet_size)  # Mínimo 64 bytes
         
         # Duración
         if 'duration' in df.columns:
-            df['duration'] = df['duration'].apply(lambda x: clean_numeric(x, 0))
+            duration = clean_numeric('duration')
         else:
-            df['duration'] = 0.0
+            duration = np.zeros(len(df))
         
         # Validar rangos
-        df['packet_size'] = df['packet_size'].clip(lower=0, upper=65535)
-        df['duration'] = df['duration'].clip(lower=0, upper=3600)  # Max 1 hora
+        np.clip(packet_size, 0, 65535, out=packet_size)
+        np.clip(duration, 0, 3600, out=duration)  # Max 1 hora
         
-        return df
+        return {'packet_size': packet_size, 'duration': duration}
     
-    def calcular_campos_derivados(self, df):
+    def calcular_campos_derivados(self, packet_size, duration):
         """Calcula campos derivados necesarios para el modelo"""
         logger.debug("Calculando campos derivados...")
         
-        # Calcular flow_bytes_per_sec
-        df['flow_bytes_per_sec'] = 0.0
-        mask = df['duration'] > 0
-        df.loc[mask, 'flow_bytes_per_sec'] = df.loc[mask, 'packet_size'] / df.loc[mask, 'duration']
-        
-        # Calcular flow_packets_per_sec (asumiendo 1 paquete por registro)
-        df['flow_packets_per_sec'] = 0.0
-        df.loc[mask, 'flow_packets_per_sec'] = 1.0 / df.loc[mask, 'duration']
-        
-        # Campos adicionales con valores por defecto
-        df['total_fwd_packets'] = 1
-        df['total_backward_packets'] = 0
-        df['total_length_fwd_packets'] = df['packet_size']
-        df['total_length_backward_packets'] = 0
-        
-        # Estadísticas de paquetes (valores básicos)
-        df['fwd_packet_length_max'] = df['packet_size']
-        df['fwd_packet_length_min'] = df['packet_size']
-        df['fwd_packet_length_mean'] = df['packet_size'].astype(float)
-        df['fwd_packet_length_std'] = 0.0
-        
-        return df
+        # Calcular flow_bytes_per_sec y flow_packets_per_sec (asumiendo 1 paquete por registro)
+        mask = duration > 0
+        flow_bytes_per_sec = np.zeros(len(duration))
+        np.divide(packet_size, duration, out=flow_bytes_per_sec, where=mask)
+        flow_packets_per_sec = np.zeros(len(duration))
+        np.divide(1.0, duration, out=flow_packets_per_sec, where=mask)
+        
+        # Contadores enteros en int32 (los tamaños ya están acotados a 65535);
+        # una sola conversión compartida por las tres columnas de longitud
+        longitud = packet_size.astype(np.int32)
+        
+        return {
+            'flow_bytes_per_sec': flow_bytes_per_sec,
+            'flow_packets_per_sec': flow_packets_per_sec,
+            # Campos adicionales con valores por defecto
+            'total_fwd_packets': np.int32(1),
+            'total_backward_packets': np.int32(0),
+            'total_length_fwd_packets': longitud,
+            'total_length_backward_packets': np.int32(0),
+            # Estadísticas de paquetes (valores básicos)
+            'fwd_packet_length_max': longitud,
+            'fwd_packet_length_min': longitud,
+            'fwd_packet_length_mean': packet_size,
+            'fwd_packet_length_std': 0.0,
+        }
     
-    def validacion_final(self, df):
-        """Validación final de datos"""
+    def validacion_final(self, columnas):
+        """Máscara de filas válidas"""
         logger.debug("Realizando validación final...")
         
-        # Eliminar filas con valores críticos inválidos
-        df = df[
-            (df['src_ip'] != '0.0.0.0') | (df['dst_ip'] != '0.0.0.0')
-        ]
+        # Al menos una IP válida
+        ips_ok = (columnas['src_ip'] != '0.0.0.0') | (columnas['dst_ip'] != '0.0.0.0')
         
-        # Eliminar filas donde ambos puertos son 0
-        df = df[
-            (df['src_port'] != 0) | (df['dst_port'] != 0)
-        ]
+        # Al menos un puerto distinto de 0
+        puertos_ok = (columnas['src_port'] != 0) | (columnas['dst_port'] != 0)
         
         # Validar que packet_size sea razonable
-        df = df[
-            (df['packet_size'] >= 20) & (df['packet_size'] <= 65535)
-        ]
+        size_ok = (columnas['packet_size'] >= 20) & (columnas['packet_size'] <= 65535)
         
-        return df
+        return ips_ok & puertos_ok & size_ok
     
     def preparar_para_bd(self, df, archivo_origen):
         """Prepara DataFrame para inserción en base de datos"""
@@ -395,25 +464,44 @@ class ProcesadorCSV:
             'fwd_packet_length_mean', 'fwd_packet_length_std'
         ]
         
+        campos_enteros = [
+            'src_port', 'dst_port', 'packet_size',
+            'total_fwd_packets', 'total_backward_packets',
+            'total_length_fwd_packets', 'total_length_backward_packets',
+            'fwd_packet_length_max', 'fwd_packet_length_min'
+        ]
+        campos_decimales = [
+            'duration', 'flow_bytes_per_sec', 'flow_packets_per_sec',
+            'fwd_packet_length_mean', 'fwd_packet_length_std'
+        ]
+        
         # Asegurar que todos los campos existen
         for campo in campos_requeridos:
             if campo not in df.columns:
-                if campo in ['tcp_flags']:
-                    df[campo] = ''
-                else:
-                    df[campo] = 0
+                df[campo] = 0
+        if 'tcp_flags' not in df.columns:
+            df['tcp_flags'] = ''
+        
+        # Fijar tipos aquí para poder crear los objetos sin conversiones por fila
+        df[campos_enteros] = df[campos_enteros].astype('int32')
+        df[campos_decimales] = df[campos_decimales].astype('float64')
+        df['src_ip'] = df['src_ip'].astype(str)
+        df['dst_ip'] = df['dst_ip'].astype(str)
+        # Pocos valores distintos: categóricas (códigos enteros + categorías) en vez de
+        # un objeto str por fila
+        df['protocol'] = df['protocol'].astype(str).str[:10].astype('category')
+        df['tcp_flags'] = df['tcp_flags'].fillna('').astype(str).str[:50]
         
         # Añadir metadatos
-        df['archivo_origen'] = os.path.basename(archivo_origen)
+        df['archivo_origen'] = pd.Categorical.from_codes(
+            np.zeros(len(df), dtype=np.int8), [os.path.basename(archivo_origen)]
+        )
         df['procesado'] = False
-        df['label'] = None
-        df['confidence_score'] = None
-        
-        # Seleccionar solo las columnas necesarias
-        columnas_finales = campos_requeridos + ['archivo_origen', 'procesado', 'label', 'confidence_score', 'tcp_flags']
-        df_final = df[columnas_finales].copy()
         
-        return df_final
+        # Seleccionar solo las columnas necesarias (la selección ya es un DataFrame
+        # nuevo y guardar_en_bd solo lo lee: no hace falta otra copia)
+        columnas_finales = campos_requeridos + ['tcp_flags', 'archivo_origen', 'procesado']
+        return df[columnas_finales]
     
     def guardar_en_bd(self, df, archivo_origen):
         """Guarda datos en base de datos Django"""
@@ -423,86 +511,89 @@ class ProcesadorCSV:
         
         logger.info(f"Guardando {len(df)} registros en base de datos...")
         
+        if connection.vendor == 'postgresql':
+            return self.copiar_en_bd(df)
+        
         registros_creados = 0
         errores = 0
         
+        # preparar_para_bd ya dejó los tipos correctos: las tuplas van directas al modelo
+        columnas = df.columns.tolist()
+        filas = df.itertuples(index=False, name=None)
+        lote_num = 0
+        
         # Procesar en lotes
-        for i in range(0, len(df), self.batch_size):
-            batch = df.iloc[i:i+self.batch_size]
-            batch_objects = []
-            
-            for _, row in batch.iterrows():
-                try:
-                    traffic_record = TraficoRed(
-                        src_ip=str(row['src_ip']),
-                        dst_ip=str(row['dst_ip']),
-                        src_port=int(row['src_port']),
-                        dst_port=int(row['dst_port']),
-                        protocol=str(row['protocol'])[:10],
-                        packet_size=int(row['packet_size']),
-                        duration=float(row['duration']),
-                        flow_bytes_per_sec=float(row['flow_bytes_per_sec']),
-                        flow_packets_per_sec=float(row['flow_packets_per_sec']),
-                        total_fwd_packets=int(row['total_fwd_packets']),
-                        total_backward_packets=int(row['total_backward_packets']),
-                        total_length_fwd_packets=int(row['total_length_fwd_packets']),
-                        total_length_backward_packets=int(row['total_length_backward_packets']),
-                        fwd_packet_length_max=int(row['fwd_packet_length_max']),
-                        fwd_packet_length_min=int(row['fwd_packet_length_min']),
-                        fwd_packet_length_mean=float(row['fwd_packet_length_mean']),
-                        fwd_packet_length_std=float(row['fwd_packet_length_std']),
-                        tcp_flags=str(row.get('tcp_flags', ''))[:50],
-                        archivo_origen=str(row['archivo_origen']),
-                        procesado=False
-                    )
-                    batch_objects.append(traffic_record)
-                    
-                except Exception as e:
-                    logger.warning(f"Error creando objeto para fila {i}: {e}")
-                    errores += 1
-                    continue
+        while True:
+            batch_objects = [
+                TraficoRed(**dict(zip(columnas, fila)))
+                for fila in itertools.islice(filas, self.batch_size)
+            ]
+            if not batch_objects:
+                break
+            lote_num += 1
             
             # Inserción en lote
-            if batch_objects:
-                try:
-                    TraficoRed.objects.bulk_create(batch_objects, ignore_conflicts=True)
-                    registros_creados += len(batch_objects)
-                    logger.debug(f"Lote {i//self.batch_size + 1}: {len(batch_objects)} registros guardados")
-                except Exception as e:
-                    logger.error(f"Error en inserción de lote: {e}")
-                    errores += len(batch_objects)
+            try:
+                # TraficoRed no tiene restricciones únicas: no hay conflictos que ignorar
+                with transaction.atomic():
+                    TraficoRed.objects.bulk_create(batch_objects, batch_size=self.db_batch_size)
+                registros_creados += len(batch_objects)
+                logger.debug("Lote %d: %d registros guardados", lote_num, len(batch_objects))
+            except Exception as e:
+                logger.error(f"Error en inserción de lote: {e}")
+                errores += len(batch_objects)
         
         logger.info(f"Guardado completado: {registros_creados} registros creados, {errores} errores")
         return registros_creados
     
+    def copiar_en_bd(self, df):
+        """PostgreSQL: inserta el bloque con COPY, sin crear objetos del modelo"""
+        # Las fechas automáticas del modelo (auto_now/auto_now_add) no las pone la BD
+        ahora = timezone.now().isoformat()
+        columnas = df.columns.tolist() + ['fecha_captura', 'updated_at']
+        
+        buffer = io.StringIO()
+        df.assign(fecha_captura=ahora, updated_at=ahora).to_csv(
+            buffer, header=False, index=False, na_rep='\\N'
+        )
+        buffer.seek(0)
+        
+        tabla = connection.ops.quote_name(TraficoRed._meta.db_table)
+        campos = ', '.join(connection.ops.quote_name(c) for c in columnas)
+        # Con NULL '\N' una cadena vacía (tcp_flags sin valor) se guarda como ''
+        sql = f"COPY {tabla} ({campos}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+        
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.copy_expert(sql, buffer)
+                registros_creados = cursor.rowcount
+        except Exception as e:
+            logger.error(f"Error en inserción con COPY: {e}")
+            return 0
+        
+        logger.info(f"Guardado completado: {registros_creados} registros creados")
+        return registros_creados
+    
     def procesar_archivo_csv(self, csv_file):
-        """Procesa un archivo CSV completo"""
+        """Procesa un archivo CSV completo, bloque a bloque"""
         try:
             archivo_path = os.path.join(self.csv_dir, csv_file)
             logger.info(f"Procesando archivo: {csv_file}")
             
-            # Leer CSV
-            df = self.leer_csv(archivo_path)
+            registros_creados = 0
+            hay_datos = False
             
-            if df.empty:
-                logger.warning(f"Archivo CSV vacío: {csv_file}")
-                return 0
-            
-            # Mapear columnas
-            df = self.mapear_columnas(df)
+            for bloque in self.iterar_csv(archivo_path):
+                creados = self.procesar_dataframe(bloque, csv_file)
+                if creados is not None:
+                    hay_datos = True
+                    registros_creados += creados
             
-            # Limpiar datos
-            df = self.limpiar_datos(df)
-            
-            if df.empty:
-                logger.warning(f"No hay datos válidos después de la limpieza: {csv_file}")
+            if not hay_datos:
+                logger.warning(f"No hay datos válidos en el archivo: {csv_file}")
                 return 0
             
-            # Preparar para BD
-            df = self.preparar_para_bd(df, csv_file)
-            
-            # Guardar en BD
-            registros_creados = self.guardar_en_bd(df, csv_file)
+            logger.info(f"Archivo {csv_file}: {registros_creados} registros creados")
             
             # Mover archivo a procesados
             if registros_creados > 0:
@@ -517,13 +608,50 @@ class ProcesadorCSV:
             self.mover_archivo_error(csv_file, str(e))
             return 0
     
+    def procesar_dataframe(self, df, csv_file):
+        """Limpia y guarda en BD un DataFrame; None si no hay datos que guardar"""
+        if df.empty:
+            logger.warning(f"Archivo CSV vacío: {csv_file}")
+            return None
+        
+        # Mapear columnas
+        df = self.mapear_columnas(df)
+        
+        # Limpiar datos
+        df = self.limpiar_datos(df)
+        
+        if df.empty:
+            logger.warning(f"No hay datos válidos después de la limpieza: {csv_file}")
+            return None
+        
+        # Preparar para BD
+        df = self.preparar_para_bd(df, csv_file)
+        
+        # Guardar en BD
+        return self.guardar_en_bd(df, csv_file)
+    
+    def procesar_stdin(self, nombre_origen):
+        """Procesa un CSV recibido por stdin (p. ej. desde flow.js --stdout)"""
+        try:
+            logger.info(f"Procesando CSV desde stdin: {nombre_origen}")
+            df = pd.read_csv(
+                sys.stdin,
+                usecols=lambda col: self.columna_estandar(col) is not None,
+                engine='c', low_memory=False
+            )
+            logger.info(f"CSV leído: {len(df)} filas, {len(df.columns)} columnas")
+            return self.procesar_dataframe(df, nombre_origen) or 0
+        except Exception as e:
+            logger.error(f"Error procesando CSV desde stdin: {e}")
+            return 0
+    
     def mover_archivo_procesado(self, csv_file):
         """Mueve archivo a directorio de procesados"""
         try:
             origen = os.path.join(self.csv_dir, csv_file)
             destino = os.path.join(self.processed_dir, csv_file)
             
-            os.rename(origen, destino)
+            shutil.move(origen, destino)
             logger.info(f"Archivo movido a procesados: {csv_file}")
             
         except Exception as e:
@@ -535,7 +663,7 @@ class ProcesadorCSV:
             origen = os.path.join(self.csv_dir, csv_file)
             destino = os.path.join(self.error_dir, csv_file)
             
-            os.rename(origen, destino)
+            shutil.move(origen, destino)
             logger.warning(f"Archivo movido a errores: {csv_file} - {error_msg}")
             
             # Crear archivo de log del error
@@ -547,7 +675,7 @@ class ProcesadorCSV:
         except Exception as e:
             logger.error(f"Error moviendo archivo a errores: {e}")
     
-    def procesar_todos_csv(self):
+    def procesar_todos_csv(self, workers=None):
         """Procesa todos los archivos CSV pendientes"""
         logger.info("Iniciando procesamiento de todos los archivos CSV")
         
@@ -563,17 +691,47 @@ class ProcesadorCSV:
         total_registros = 0
         total_errores = 0
         
-        for archivo in archivos:
-            try:
-                registros = self.procesar_archivo_csv(archivo)
-                if registros > 0:
-                    total_procesados += 1
-                    total_registros += registros
-                else:
-                    total_errores += 1
-                    
-            except Exception as e:
-                logger.error(f"Error procesando {archivo}: {e}")
+        workers = workers or min(os.cpu_count() or 1, len(archivos))
+        # SQLite no admite escrituras concurrentes desde varios procesos
+        if DJANGO_AVAILABLE and connection.vendor == 'sqlite':
+            workers = 1
+        
+        if workers > 1:
+            logger.info(f"Procesando con {workers} procesos")
+            # Cada proceso hijo abre su propia conexión; no heredar las del padre
+            if DJANGO_AVAILABLE:
+                connections.close_all()
+            
+            # spawn: los hijos importan este módulo de cero (Django y logging
+            # propios) en lugar de heredar por fork los hilos y locks del
+            # proceso que llama, p. ej. el QueueListener de iniciar_pipeline
+            contexto = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=contexto) as executor:
+                futuros = {
+                    executor.submit(_procesar_en_proceso, self.csv_dir, archivo, self.batch_size): archivo
+                    for archivo in archivos
+                }
+                resultados = []
+                for futuro in as_completed(futuros):
+                    try:
+                        resultados.append(futuro.result())
+                    except Exception as e:
+                        logger.error(f"Error procesando {futuros[futuro]}: {e}")
+                        resultados.append(0)
+        else:
+            resultados = []
+            for archivo in archivos:
+                try:
+                    resultados.append(self.procesar_archivo_csv(archivo))
+                except Exception as e:
+                    logger.error(f"Error procesando {archivo}: {e}")
+                    resultados.append(0)
+        
+        for registros in resultados:
+            if registros > 0:
+                total_procesados += 1
+                total_registros += registros
+            else:
                 total_errores += 1
         
         resultado = {
@@ -603,11 +761,13 @@ class ProcesadorCSV:
             
             procesados = 0
             if os.path.exists(self.processed_dir):
-                procesados = len([f for f in os.listdir(self.processed_dir) if f.endswith('.csv')])
+                with os.scandir(self.processed_dir) as entradas:
+                    procesados = sum(1 for e in entradas if e.name.endswith('.csv'))
             
             errores = 0
             if os.path.exists(self.error_dir):
-                errores = len([f for f in os.listdir(self.error_dir) if f.endswith('.csv')])
+                with os.scandir(self.error_dir) as entradas:
+                    errores = sum(1 for e in entradas if e.name.endswith('.csv'))
             
             stats = {
                 'archivos_pendientes': pendientes,
@@ -631,9 +791,12 @@ def main():
     parser = argparse.ArgumentParser(description='Procesador de archivos CSV de tráfico de red')
     parser.add_argument('--csv-dir', '-d', help='Directorio de archivos CSV')
     parser.add_argument('--file', '-f', help='Archivo CSV específico a procesar')
-    parser.add_argument('--batch-size', '-b', type=int, default=1000, help='Tamaño de lote para BD')
+    parser.add_argument('--batch-size', '-b', type=int, help='Tamaño de lote para BD (por defecto CSV_BULK_CREATE_BATCH_SIZE o 1000)')
     parser.add_argument('--stats', '-s', action='store_true', help='Mostrar estadísticas')
     parser.add_argument('--all', '-a', action='store_true', help='Procesar todos los archivos')
+    parser.add_argument('--workers', '-w', type=int, help='Procesos en paralelo para --all (por defecto uno por CPU)')
+    parser.add_argument('--stdin', action='store_true', help='Leer el CSV desde stdin')
+    parser.add_argument('--origen', default='stdin.csv', help='Nombre de archivo de origen para --stdin')
     
     args = parser.parse_args()
     
@@ -648,13 +811,18 @@ def main():
             procesador.obtener_estadisticas()
             return
         
+        if args.stdin:
+            registros = procesador.procesar_stdin(args.origen)
+            logger.info(f"CSV {args.origen} procesado desde stdin: {registros} registros")
+            return
+        
         if args.file:
             registros = procesador.procesar_archivo_csv(args.file)
             logger.info(f"Archivo {args.file} procesado: {registros} registros")
             return
         
         if args.all or not args.file:
-            resultado = procesador.procesar_todos_csv()
+            resultado = procesador.procesar_todos_csv(workers=args.workers)
             logger.info(f"Procesamiento masivo completado: {resultado}")
             return
             